@@ -0,0 +1,278 @@
+"""
+Benchmarks of the picking, correlation and sweep hot paths.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks                                  # full run
+    python -m benchmarks.run_benchmarks --quick --filter aic             # small sizes, only the aic cases
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json --tolerance 0.2
+    python -m benchmarks.run_benchmarks --import-budget 0.6 --filter none  # only the import time check
+
+Every case reports the best wall time of the repeats, the throughput in traces/s and the peak traced memory.
+With --compare, a case slower than the baseline by more than the tolerance is flagged and the exit code is 1.
+With --import-budget, every compute core module is imported in a fresh interpreter (as a worker process does),
+and a module slower than the budget or loading a plotting / I/O module is flagged and the exit code is 1.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+from scipy.signal import correlate
+
+from code_section.sensors import SensorObj
+from code_section.noise import add_noise
+from code_section.workspace import Workspace
+from code_section.consts import DATA_DIR, SENSOR_NUMBER_SIZE, SNR_RATIO_DB, NOISE_TYPES
+from code_section.correlation import PilotCorrelator, TemplateBank
+from code_section.events import detect_channel_events
+from code_section.utils.utils import load_mat_file, aic_pick, aic_pick_batch, separate_channels, normalize_gather
+from code_section.algorithms import full_picking_algorithm, gather_picking_algorithm, run_batched_performance_analysis, \
+    moveout_picking_algorithm, tiered_picking_algorithm
+
+MAT_FIXTURES = ["simulation_ricker.mat", "simulation_continuous.mat", "simulation_multisource.mat"]
+# The compute core must not load the modules that only plotting and .mat / HDF5 loading need
+CORE_MODULES = ["code_section.algorithms", "code_section.gather", "code_section.pipeline", "code_section.sweep",
+                "code_section.batch", "code_section.ingest", "code_section.utils.graph_utils"]
+HEAVY_MODULES = ["matplotlib", "scipy.io", "scipy.signal", "h5py"]
+
+
+def ricker_wavelet(frequency, fs, length=0.1):
+    t = np.arange(-length / 2, length / 2, 1 / fs)
+    return (1 - 2 * (np.pi * frequency * t) ** 2) * np.exp(-(np.pi * frequency * t) ** 2)
+
+
+def synthetic_gather(n_sensors=64, n_samples=1000, fs=2000, n_sources=1, snr_db=20, seed=0):
+    """
+    Synthetic shot: ricker arrivals with a linear moveout for each source plus white noise.
+    :return: (data (n_sensors, n_samples) float32, fs, geometry (n_sensors, 3)).
+    """
+    rng = np.random.default_rng(seed)
+    wavelet = ricker_wavelet(30, fs)
+    data = np.zeros((n_sensors, n_samples))
+    for source in range(n_sources):
+        first_arrival = int((source + 0.1) * n_samples / (n_sources + 0.2))
+        arrivals = first_arrival + (np.arange(n_sensors) * 0.15 * n_samples / (n_sources * n_sensors)).astype(int)
+        for sensor_num, arrival in enumerate(arrivals):
+            end = min(arrival + len(wavelet), n_samples)
+            data[sensor_num, arrival:end] += wavelet[:end - arrival]
+    noise_power = np.mean(data ** 2) / 10 ** (snr_db / 10)
+    data += rng.normal(0, np.sqrt(noise_power), data.shape)
+    geometry = np.stack([np.arange(n_sensors) * 10.0, np.zeros(n_sensors), np.zeros(n_sensors)], axis=-1)
+    return data.astype(np.float32), fs, geometry
+
+
+def mat_fixture(file_name):
+    sensors_data_dict = load_mat_file(os.path.join(DATA_DIR, file_name))
+    return sensors_data_dict['data'], sensors_data_dict['fs'][0][0], sensors_data_dict['geometry']
+
+
+def measure(function, n_traces, repeats):
+    """
+    Run function repeats times (its prints are silenced).
+    :return: dict of the best wall time, throughput (traces/s) and peak traced memory (MB).
+    """
+    wall_times = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            wall_times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(wall_times)
+    return {'wall_time_s': best, 'traces_per_s': n_traces / best, 'peak_memory_mb': peak / 1024 ** 2}
+
+
+def build_cases(quick=False):
+    """
+    The benchmark cases: (name, function, number of traces it processes).
+    """
+    channel_counts = [64, 256] if quick else [64, 256, 1024]
+    trace_lengths = [1000, 4000] if quick else [1000, 4000, 16000]
+    iteration_counts = [5, 20] if quick else [10, 50, 100]
+    cases = []
+
+    for file_name in MAT_FIXTURES:
+        data, fs, geometry = mat_fixture(file_name)
+        name = file_name.replace("simulation_", "").replace(".mat", "")
+        cases.append((f"full_picking_algorithm[{name}]",
+                      lambda data=data, fs=fs, geometry=geometry: full_picking_algorithm(data, geometry, len(data), fs),
+                      len(data)))
+        cases.append((f"gather_picking_algorithm[{name}]",
+                      lambda data=data, fs=fs: gather_picking_algorithm(data, fs), len(data)))
+
+    multisource_data, multisource_fs, _ = mat_fixture("simulation_multisource.mat")
+    cases.append(("separate_channels[multisource]",
+                  lambda: [separate_channels(SensorObj(trace, multisource_fs)) for trace in multisource_data],
+                  len(multisource_data)))
+    cases.append(("detect_channel_events[multisource]",
+                  lambda: detect_channel_events(normalize_gather(multisource_data), multisource_fs),
+                  len(multisource_data)))
+
+    for n_sources in (3, 12):
+        data, fs, _ = synthetic_gather(n_sensors=64, n_samples=16000, n_sources=n_sources)
+        normalized_data = normalize_gather(data)
+        source_starts = (np.arange(n_sources + 1) * 16000 / (n_sources + 0.2)).astype(int)
+        templates = [normalized_data[0, start:start + 200] for start in source_starts[:-1]]
+        event_windows = np.broadcast_to(np.stack([source_starts[:-1], source_starts[1:]], axis=-1), (64, n_sources, 2))
+        cases.append((f"pilot_correlator_per_source[sources={n_sources}]",
+                      lambda x=normalized_data, t=templates: [PilotCorrelator(template).pick(x) for template in t], 64))
+        cases.append((f"template_bank[sources={n_sources}]",
+                      lambda x=normalized_data, t=templates: TemplateBank(t).pick(x), 64))
+        cases.append((f"template_bank_event_windows[sources={n_sources}]",
+                      lambda x=normalized_data, t=templates, w=event_windows: TemplateBank(t).pick(x, windows=w), 64))
+
+    for n_sensors in channel_counts:
+        data, fs, _ = synthetic_gather(n_sensors=n_sensors, n_samples=2000)
+        cases.append((f"gather_picking_algorithm[channels={n_sensors}]",
+                      lambda data=data, fs=fs: gather_picking_algorithm(data, fs, noise_type="white", snr_db=5),
+                      n_sensors))
+        cases.append((f"gather_picking_algorithm[channels={n_sensors},float32]",
+                      lambda data=data, fs=fs, workspace=Workspace(): gather_picking_algorithm(
+                          data, fs, noise_type="white", snr_db=5, dtype=np.float32, workspace=workspace),
+                      n_sensors))
+
+    for n_samples in trace_lengths:
+        data, fs, geometry = synthetic_gather(n_sensors=64, n_samples=n_samples)
+        normalized_data = normalize_gather(data)
+        signal_pattern = normalized_data[0, 100:550]
+        windows = np.stack([np.zeros(64, dtype=int), np.full(64, n_samples)], axis=-1)
+        cases.append((f"scipy_correlate[samples={n_samples}]",
+                      lambda x=normalized_data, p=signal_pattern: [np.argmax(correlate(trace, p, mode='valid'))
+                                                                   for trace in x], 64))
+        cases.append((f"pilot_correlator[samples={n_samples}]",
+                      lambda x=normalized_data, p=signal_pattern: PilotCorrelator(p).pick(x), 64))
+        cases.append((f"moveout_picking_algorithm[samples={n_samples}]",
+                      lambda data=data, fs=fs, geometry=geometry: moveout_picking_algorithm(data, geometry, fs), 64))
+        cases.append((f"tiered_picking_algorithm[samples={n_samples}]",
+                      lambda data=data, fs=fs: tiered_picking_algorithm(data, fs), 64))
+        cases.append((f"tiered_picking_algorithm_workspace[samples={n_samples}]",
+                      lambda data=data, fs=fs, workspace=Workspace(): tiered_picking_algorithm(
+                          data, fs, workspace=workspace), 64))
+        cases.append((f"aic_pick[samples={n_samples}]",
+                      lambda x=normalized_data: [aic_pick(trace) for trace in x], 64))
+        cases.append((f"aic_pick_batch[samples={n_samples}]",
+                      lambda x=normalized_data, w=windows: aic_pick_batch(x, w), 64))
+        cases.append((f"aic_pick_batch_workspace[samples={n_samples}]",
+                      lambda x=normalized_data, w=windows, workspace=Workspace(): aic_pick_batch(
+                          x, w, workspace=workspace), 64))
+
+    noise_data, noise_fs, _ = synthetic_gather(n_sensors=64, n_samples=1000)
+    for num_iterations in iteration_counts:
+        for noise_type in NOISE_TYPES:
+            for dtype in (np.float64, np.float32):
+                cases.append((f"add_noise[{noise_type},{np.dtype(dtype).name},trials={num_iterations}]",
+                              lambda n=num_iterations, t=noise_type, d=dtype: add_noise(
+                                  noise_data, snr_db=0, noise_type=t, fs=noise_fs, rng=np.random.default_rng(0),
+                                  dtype=d, trials=n), num_iterations * 64))
+
+    ricker_path = os.path.join(DATA_DIR, "simulation_ricker.mat")
+    for num_iterations in iteration_counts:
+        n_picks = num_iterations * SENSOR_NUMBER_SIZE * len(NOISE_TYPES) * len(SNR_RATIO_DB)
+        cases.append((f"run_batched_performance_analysis[iterations={num_iterations}]",
+                      lambda n=num_iterations: run_batched_performance_analysis(ricker_path, n), n_picks))
+    return cases
+
+
+def measure_import(module_name):
+    """
+    Import module_name in a fresh interpreter.
+    :return: (import wall time (s), the HEAVY_MODULES it loaded).
+    """
+    code = (f"import sys, time; start = time.perf_counter(); import {module_name}; "
+            f"print(time.perf_counter() - start); print(' '.join(name for name in {HEAVY_MODULES!r} "
+            f"if name in sys.modules))")
+    repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=repository_root, capture_output=True, text=True,
+                            check=True).stdout.splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+def check_import_budget(budget_s, repeats=3):
+    """
+    :return: list of (module, best import time, heavy modules) of the CORE_MODULES that take more than budget_s
+             to import or load one of the HEAVY_MODULES.
+    """
+    violations = []
+    for module_name in CORE_MODULES:
+        imports = [measure_import(module_name) for _ in range(repeats)]
+        import_time, heavy_modules = min(import_time for import_time, _ in imports), imports[0][1]
+        print(f"import {module_name:57s} {import_time * 1e3:10.2f} ms {' '.join(heavy_modules)}")
+        if import_time > budget_s or heavy_modules:
+            violations.append((module_name, import_time, heavy_modules))
+    return violations
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    :return: list of (name, baseline wall time, current wall time) of the cases that are slower than the
+             baseline by more than tolerance (relative).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline['results']:
+            baseline_time = baseline['results'][name]['wall_time_s']
+            if result['wall_time_s'] > baseline_time * (1 + tolerance):
+                regressions.append((name, baseline_time, result['wall_time_s']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the picking hot paths")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes for a fast run")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--filter", default="", help="run only the cases with this text in their name")
+    parser.add_argument("--save-baseline", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results to this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--import-budget", type=float, help="allowed import time (s) of the compute core modules")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, function, n_traces in build_cases(quick=args.quick):
+        if args.filter not in name:
+            continue
+        results[name] = measure(function, n_traces, args.repeats)
+        print(f"{name:65s} {results[name]['wall_time_s'] * 1e3:10.2f} ms "
+              f"{results[name]['traces_per_s']:12.0f} traces/s {results[name]['peak_memory_mb']:9.2f} MB")
+
+    if args.save_baseline:
+        baseline = {'machine': platform.platform(), 'python': platform.python_version(),
+                    'numpy': np.__version__, 'results': results}
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(args.save_baseline)),
+                                         delete=False) as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+        os.replace(baseline_file.name, args.save_baseline)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        for name, baseline_time, current_time in regressions:
+            print(f"REGRESSION {name}: {baseline_time * 1e3:.2f} ms -> {current_time * 1e3:.2f} ms")
+        if regressions:
+            return 1
+
+    if args.import_budget is not None:
+        violations = check_import_budget(args.import_budget, repeats=args.repeats)
+        for module_name, import_time, heavy_modules in violations:
+            print(f"IMPORT BUDGET {module_name}: {import_time * 1e3:.2f} ms {' '.join(heavy_modules)}")
+        if violations:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,18 @@
 import numpy as np
 
 from code_section.sensors import SensorObj
+from code_section.noise import add_noise
+from code_section.correlation import PilotCorrelator, TemplateBank
+from code_section.events import detect_channel_events
+from code_section.moveout import spread_offsets, fit_moveout, predict_moveout, moveout_windows
 from code_section.consts import SENSOR_NUMBER_SIZE, SNR_RATIO_DB, NOISE_TYPES, STA_LTA_PARAMS
-from code_section.utils.utils import load_mat_file, aic_pick
+from code_section.workspace import Workspace
+from code_section.quality import PICK_QUALITY_DTYPE, sta_lta_margin, aic_sharpness, onset_power_ratio
+from code_section.instrumentation import get_instrumentation
+from code_section.utils.utils import load_mat_file, aic_pick, aic_pick_batch, normalize_gather, sta_lta_gather, \
+    find_break_ranges
+
+instrumentation = get_instrumentation()
 
 def run_performance_analysis(data_file_path: str, num_iterations: int):
     """
@@ -47,7 +57,8 @@ def run_performance_analysis(data_file_path: str, num_iterations: int):
                 mean_errors[sensor_num].append(mean_error)
                 std_errors[sensor_num].append(std_error)
 
-            print(f"SNR: {snr:5.1f} dB | Mean Error: {mean_error:6.2f} samples | Std Dev: {std_error:6.2f} samples")
+            instrumentation.event('snr_step', noise_type=noise_type, snr_db=snr, mean_error=float(mean_error),
+                                  std_error=float(std_error))
 
         for i in range(SENSOR_NUMBER_SIZE):
             results[i][noise_type] = {'mean': np.array(mean_errors[i]), 'std': np.array(std_errors[i])}
@@ -55,6 +66,108 @@ def run_performance_analysis(data_file_path: str, num_iterations: int):
     return results
 
 
+def merge_running_stats(count, mean, m2, other_count, other_mean, other_m2):
+    """
+    Merge two running count / mean / sum of squared deviations (Chan et al.),
+    so the std can be computed without keeping all the iterations in memory.
+    """
+    total = count + other_count
+    delta = other_mean - mean
+    mean = mean + delta * other_count / total
+    m2 = m2 + other_m2 + delta ** 2 * count * other_count / total
+    return total, mean, m2
+
+def update_running_stats(count, mean, m2, batch):
+    """
+    Merge a batch (iterations, ...) into running count / mean / sum of squared deviations.
+    """
+    batch_mean = np.mean(batch, axis=0)
+    batch_m2 = np.sum((batch - batch_mean) ** 2, axis=0)
+    return merge_running_stats(count, mean, m2, batch.shape[0], batch_mean, batch_m2)
+
+def run_batched_performance_analysis(data_file_path: str, num_iterations: int, batch_size=None,
+                                     pattern_method="sta_lta", cache=None, dtype=np.float64):
+    """
+    Vectorized Monte Carlo mode of run_performance_analysis.
+    The noise realizations of each noise type and SNR level are drawn as one (iterations, sensors, samples)
+    batch and picked in one pass. batch_size limits the iterations held in memory at once (default: all of them),
+    the mean and std are accumulated online between the batches.
+    cache is an optional ResultCache for the clean data products (see compute_base_products).
+    The noised batches are generated in one reused buffer of dtype (np.float32 halves the memory traffic).
+
+    Returns:
+        The same results structure as run_performance_analysis.
+    """
+    sensors_data_dict = load_mat_file(mat_path_file=data_file_path)
+    sensors_sample_rate = sensors_data_dict['fs'][0][0]
+    sensors_data = np.asarray(sensors_data_dict['data'])[:SENSOR_NUMBER_SIZE]
+    batch_size = batch_size or num_iterations
+
+    # The clean data, its signal pattern range and picks are the same for all the settings
+    base_products = compute_base_products(sensors_data, sensors_sample_rate, pattern_method, cache=cache)
+    normalized_data = base_products['normalized_data']
+    first_break_frame, end_break_frame = base_products['pattern_range']
+    true_first_break_samples = base_products['reference_first_breaks']
+
+    results = [{} for _ in range(SENSOR_NUMBER_SIZE)]
+    workspace = Workspace()
+
+    for noise_type in NOISE_TYPES:
+        mean_errors, std_errors = [], []
+
+        for snr in SNR_RATIO_DB:
+            count, mean_error, m2_error = 0, np.zeros(SENSOR_NUMBER_SIZE), np.zeros(SENSOR_NUMBER_SIZE)
+            for start in range(0, num_iterations, batch_size):
+                iterations = min(batch_size, num_iterations - start)
+                with instrumentation.stage('noise', iterations=iterations):
+                    noised_batch = add_noise(normalized_data, snr_db=snr, noise_type=noise_type, fs=sensors_sample_rate,
+                                             trials=iterations, out=workspace.get(
+                                                 'noised_batch', (iterations,) + normalized_data.shape, dtype))
+                errors = pick_gather(noised_batch, first_break_frame, end_break_frame,
+                                     sensors_sample_rate, dtype=dtype) - true_first_break_samples
+                count, mean_error, m2_error = update_running_stats(count, mean_error, m2_error, errors)
+
+            std_error = np.sqrt(m2_error / count)
+            mean_errors.append(mean_error)
+            std_errors.append(std_error)
+
+            instrumentation.event('snr_step', noise_type=noise_type, snr_db=snr, mean_error=float(mean_error[-1]),
+                                  std_error=float(std_error[-1]))
+
+        mean_errors, std_errors = np.array(mean_errors), np.array(std_errors)
+        for i in range(SENSOR_NUMBER_SIZE):
+            results[i][noise_type] = {'mean': mean_errors[:, i], 'std': std_errors[:, i]}
+
+    return results
+
+
+def sta_lta_signal_pattern_range(pilot_sensor: SensorObj):
+    """
+    Find the signal pattern range [first_break_frame:end_break_frame] of the pilot sensor
+    with STA/LTA and refine its start with the AIC picker.
+    """
+    with instrumentation.stage('sta_lta'):
+        first_break_frame, end_break_frame = pilot_sensor.find_break_range(**STA_LTA_PARAMS)
+    return refine_signal_pattern_range(pilot_sensor.data, first_break_frame, end_break_frame)
+
+def refine_signal_pattern_range(pilot_data, first_break_frame, end_break_frame):
+    """
+    Refine the start of the STA/LTA break range with the AIC picker on the range data.
+    """
+    with instrumentation.stage('aic'):
+        first_break_frame = int(aic_pick(pilot_data[first_break_frame:end_break_frame]))
+    return first_break_frame, end_break_frame
+
+def aic_signal_pattern_range(pilot_data, pattern_length=450):
+    """
+    Find the signal pattern range [first_break_frame:end_break_frame] of the pilot sensor
+    with the AIC picker on the raw data.
+    """
+    with instrumentation.stage('aic'):
+        first_break_frame = int(aic_pick(pilot_data))
+    end_break_frame = first_break_frame + pattern_length # figure how to find the end break frame
+    return first_break_frame, end_break_frame
+
 def full_picking_algorithm(sensors_data, sensors_geometry_data,
                            sensors_length, sensors_sample_rate, noise_type="", snr_db=2):
     """
@@ -67,21 +180,25 @@ def full_picking_algorithm(sensors_data, sensors_geometry_data,
     sensors_list, signal_pattern = [], None
 
     for sensor_num in range(sensors_length):
-        temp_sensor_obj = SensorObj(data=sensors_data[sensor_num],
-                                    sampling_rate=sensors_sample_rate,
-                                    geometry_location=sensors_geometry_data[sensor_num])
+        with instrumentation.stage('normalization', sensor=sensor_num + 1):
+            temp_sensor_obj = SensorObj(data=sensors_data[sensor_num],
+                                        sampling_rate=sensors_sample_rate,
+                                        geometry_location=sensors_geometry_data[sensor_num])
         if sensor_num == 0: #Used the same first-break signal pattern for all the sensors?
-            first_break_frame, end_break_frame = temp_sensor_obj.find_break_range(**STA_LTA_PARAMS)
-            first_break_frame = int(aic_pick(temp_sensor_obj.data[first_break_frame:end_break_frame]))
+            first_break_frame, end_break_frame = sta_lta_signal_pattern_range(temp_sensor_obj)
             signal_pattern = temp_sensor_obj.data[first_break_frame:end_break_frame]
-            print(f"{sensor_num + 1} - [{first_break_frame}:{end_break_frame}]")
+            instrumentation.event('signal_pattern', sensor=sensor_num + 1, first_break_frame=first_break_frame,
+                                  end_break_frame=end_break_frame)
 
         if noise_type:
-            temp_sensor_obj.add_noise(snr_db=snr_db, noise_type=noise_type)
+            with instrumentation.stage('noise', sensor=sensor_num + 1):
+                temp_sensor_obj.add_noise(snr_db=snr_db, noise_type=noise_type)
 
-        correlation_result = temp_sensor_obj.cross_correlation(signal_pattern)
-        temp_sensor_obj.first_break_time = np.argmax(correlation_result) / sensors_sample_rate
-        print("Sensor number: {} \n The first break is in: {}".format(sensor_num + 1, temp_sensor_obj.first_break_time))
+        with instrumentation.stage('correlation', sensor=sensor_num + 1):
+            correlation_result = temp_sensor_obj.cross_correlation(signal_pattern)
+            temp_sensor_obj.first_break_time = np.argmax(correlation_result) / sensors_sample_rate
+        instrumentation.event('first_break', sensor=sensor_num + 1,
+                              first_break_time=float(temp_sensor_obj.first_break_time))
         sensors_list.append(temp_sensor_obj)
 
     return sensors_list
@@ -98,22 +215,446 @@ def full_picking_algorithm2(sensors_data, sensors_geometry_data,
     sensors_list, signal_pattern = [], None
 
     for sensor_num in range(sensors_length):
-        temp_sensor_obj = SensorObj(data=sensors_data[sensor_num],
-                                    sampling_rate=sensors_sample_rate,
-                                    geometry_location=sensors_geometry_data[sensor_num])
+        with instrumentation.stage('normalization', sensor=sensor_num + 1):
+            temp_sensor_obj = SensorObj(data=sensors_data[sensor_num],
+                                        sampling_rate=sensors_sample_rate,
+                                        geometry_location=sensors_geometry_data[sensor_num])
         if sensor_num == 0:
-            first_break_frame = int(aic_pick(sensors_data[sensor_num]))
-            end_break_frame = first_break_frame + 450 # figure how to find the end break frame
+            first_break_frame, end_break_frame = aic_signal_pattern_range(sensors_data[sensor_num])
             signal_pattern = temp_sensor_obj.data[first_break_frame:end_break_frame]
-            print(f"{sensor_num + 1} - [{first_break_frame}:{end_break_frame}]")
+            instrumentation.event('signal_pattern', sensor=sensor_num + 1, first_break_frame=first_break_frame,
+                                  end_break_frame=end_break_frame)
 
         if noise_type: #Used the same first-break signal pattern for all the sensors?
-            temp_sensor_obj.add_noise(snr_db=snr_db, noise_type=noise_type)
+            with instrumentation.stage('noise', sensor=sensor_num + 1):
+                temp_sensor_obj.add_noise(snr_db=snr_db, noise_type=noise_type)
 
-        correlation_result = temp_sensor_obj.cross_correlation(signal_pattern)
-        temp_sensor_obj.first_break_time = np.argmax(correlation_result) / sensors_sample_rate
-        print("Sensor number: {} \n The first break is in: {}".
-              format(sensor_num + 1, temp_sensor_obj.first_break_time))
+        with instrumentation.stage('correlation', sensor=sensor_num + 1):
+            correlation_result = temp_sensor_obj.cross_correlation(signal_pattern)
+            temp_sensor_obj.first_break_time = np.argmax(correlation_result) / sensors_sample_rate
+        instrumentation.event('first_break', sensor=sensor_num + 1,
+                              first_break_time=float(temp_sensor_obj.first_break_time))
         sensors_list.append(temp_sensor_obj)
 
-    return sensors_list
\ No newline at end of file
+    return sensors_list
+
+def gather_signal_pattern_range(sensors_data, sensors_sample_rate, pattern_method="sta_lta"):
+    """
+    Find the signal pattern range of the first sensor of the gather.
+    pattern_method 'sta_lta' is the full_picking_algorithm way and 'aic' is the full_picking_algorithm2 way.
+    """
+    if pattern_method == "sta_lta":
+        pilot_sensor = SensorObj(data=sensors_data[0], sampling_rate=sensors_sample_rate)
+        return sta_lta_signal_pattern_range(pilot_sensor)
+    if pattern_method == "aic":
+        return aic_signal_pattern_range(sensors_data[0])
+    raise ValueError("pattern_method must be 'sta_lta' or 'aic'")
+
+def pick_gather(normalized_data, first_break_frame, end_break_frame, sensors_sample_rate, signal_pattern=None,
+                return_peak=False, dtype=np.float64):
+    """
+    Cross-correlate each trace with the signal pattern of its gather first sensor and pick the maximum.
+    normalized_data can be (n_sensors, n_samples) or a batch of gathers (..., n_sensors, n_samples),
+    in that case every gather is correlated with its own signal pattern.
+    signal_pattern can be given when the first sensor is not in normalized_data (a block of the gather).
+    dtype is the correlation precision (see PilotCorrelator).
+
+    Returns:
+        Array (..., n_sensors) of the first break time (seconds) of each sensor,
+        and the normalized correlation peak of each sensor when return_peak.
+    """
+    if signal_pattern is None:
+        # as in the per-sensor algorithms, the pattern is sliced from the (noised) first sensor data
+        signal_pattern = normalized_data[..., :1, first_break_frame:end_break_frame]
+    with instrumentation.stage('correlation', traces=int(np.prod(normalized_data.shape[:-1]))):
+        if return_peak:
+            lags, peaks = PilotCorrelator(signal_pattern, dtype=dtype).pick(normalized_data, return_peak=True)
+            return lags / sensors_sample_rate, peaks
+        return PilotCorrelator(signal_pattern, dtype=dtype).pick(normalized_data) / sensors_sample_rate
+
+def compute_base_products(sensors_data, sensors_sample_rate, pattern_method="sta_lta", cache=None,
+                          workspace=None) -> dict:
+    """
+    Compute the noise-free products of the gather that are the same for every noise type and SNR:
+    normalized_data, sta_lta_ratio, break_ranges (per sensor), pattern_range, signal_pattern and
+    reference_first_breaks (seconds).
+    With a ResultCache they are keyed by the data, sampling rate, STA_LTA_PARAMS and pattern_method,
+    and loaded from the disk when they were already computed.
+    A Workspace holds the STA/LTA scratch buffers, the products themselves are always new arrays (they are
+    returned and cached).
+    """
+    sensors_data = np.asarray(sensors_data)
+
+    def compute():
+        with instrumentation.stage('normalization', traces=len(sensors_data)):
+            normalized_data = normalize_gather(sensors_data)
+        with instrumentation.stage('sta_lta', traces=len(sensors_data)):
+            sta_lta_ratio = sta_lta_gather(normalized_data, STA_LTA_PARAMS['sta_group_size'],
+                                           STA_LTA_PARAMS['lta_group_size'], workspace=workspace)
+        first_break_frames, end_break_frames = find_break_ranges(sta_lta_ratio, STA_LTA_PARAMS['threshold'],
+                                                                 max_gap=int(0.1 * sensors_sample_rate))
+        first_break_frame, end_break_frame = gather_signal_pattern_range(sensors_data, sensors_sample_rate,
+                                                                         pattern_method)
+        instrumentation.count('base_products_computed')
+        return {'normalized_data': normalized_data,
+                'sta_lta_ratio': sta_lta_ratio,
+                'break_ranges': np.stack([first_break_frames, end_break_frames], axis=-1),
+                'pattern_range': np.array([first_break_frame, end_break_frame]),
+                'signal_pattern': normalized_data[0, first_break_frame:end_break_frame],
+                'reference_first_breaks': pick_gather(normalized_data, first_break_frame, end_break_frame,
+                                                      sensors_sample_rate)}
+
+    if cache is None:
+        return compute()
+    key = cache.make_key(sensors_data, sensors_sample_rate=sensors_sample_rate, pattern_method=pattern_method,
+                         sta_lta_params=STA_LTA_PARAMS)
+    return cache.get_or_compute(key, compute)
+
+def gather_picking_algorithm(sensors_data, sensors_sample_rate, sensors_length=None,
+                             noise_type="", snr_db=2, pattern_method="sta_lta", cache=None, dtype=None,
+                             workspace=None):
+    """
+    Gather-level variation of full_picking_algorithm (pattern_method='sta_lta') and
+    full_picking_algorithm2 (pattern_method='aic').
+    The whole (n_sensors, n_samples) array is normalized, noised, cross-correlated with the signal pattern
+    of the first sensor and picked in batched operations instead of one SensorObj per trace.
+    cache is an optional ResultCache for the clean data products (see compute_base_products).
+    With a dtype (np.float32 halves the memory traffic) or a Workspace (code_section.workspace) the data is
+    normalized into one buffer of dtype and noised in place on it, reusing the workspace buffers across calls.
+
+    Returns:
+        Array of the first break time (seconds) of each sensor.
+    """
+    sensors_data = np.asarray(sensors_data)
+    if sensors_length is not None:
+        sensors_data = sensors_data[:sensors_length]
+    assert len(sensors_data), "Sensors data is empty!"
+
+    in_place = dtype is not None or workspace is not None
+    if cache is None:
+        with instrumentation.stage('normalization', traces=len(sensors_data)):
+            normalized_data = _normalize_to_buffer(sensors_data, dtype, workspace) if in_place else \
+                normalize_gather(sensors_data)
+        first_break_frame, end_break_frame = gather_signal_pattern_range(sensors_data, sensors_sample_rate,
+                                                                         pattern_method)
+    else:
+        base_products = compute_base_products(sensors_data, sensors_sample_rate, pattern_method, cache=cache,
+                                              workspace=workspace)
+        normalized_data = base_products['normalized_data']
+        if in_place:
+            # the cached products are not changed, the noise goes to a copy in the buffer
+            normalized_data = _copy_to_buffer(normalized_data, dtype, workspace)
+        first_break_frame, end_break_frame = base_products['pattern_range']
+    instrumentation.event('signal_pattern', sensor=1, first_break_frame=int(first_break_frame),
+                          end_break_frame=int(end_break_frame))
+
+    if noise_type:
+        with instrumentation.stage('noise', traces=len(normalized_data)):
+            if in_place:
+                add_noise(normalized_data, snr_db=snr_db, noise_type=noise_type, fs=sensors_sample_rate,
+                          out=normalized_data, workspace=workspace)
+            else:
+                normalized_data = add_noise(normalized_data, snr_db=snr_db, noise_type=noise_type,
+                                            fs=sensors_sample_rate)
+
+    return pick_gather(normalized_data, first_break_frame, end_break_frame, sensors_sample_rate,
+                       dtype=dtype or np.float64)
+
+def _normalize_to_buffer(sensors_data, dtype=None, workspace=None):
+    """
+    normalize_gather to a buffer of dtype (float64 by default), the workspace 'normalized_data' buffer when given.
+    """
+    dtype = np.dtype(dtype or np.float64)
+    out = None if workspace is None else workspace.get('normalized_data', sensors_data.shape, dtype)
+    return normalize_gather(sensors_data, dtype=dtype, out=out)
+
+def _copy_to_buffer(data, dtype=None, workspace=None):
+    dtype = np.dtype(dtype or np.float64)
+    if workspace is None:
+        return np.array(data, dtype=dtype)
+    out = workspace.get('normalized_data', data.shape, dtype)
+    np.copyto(out, data, casting='same_kind')
+    return out
+
+def data_source_picking_algorithm(data_source, block_size=256, noise_type="", snr_db=2, pattern_method="sta_lta",
+                                  return_peaks=False, dtype=np.float64, rng=None):
+    """
+    gather_picking_algorithm over a DataSource (code_section.utils.data_sources) that is read by blocks of
+    block_size traces, so the memory does not depend on the number of traces in the file.
+    Every block is normalized and noised in place in the same buffers of dtype (np.float32 halves the memory
+    traffic).
+    :param rng: np.random.Generator for reproducible noise, the global np.random state is used by default.
+
+    Returns:
+        Array of the first break time (seconds) of each sensor,
+        and the normalized correlation peak of each sensor when return_peaks.
+    """
+    first_break_frame, end_break_frame = gather_signal_pattern_range(data_source.read(traces=slice(0, 1)),
+                                                                     data_source.fs, pattern_method)
+    instrumentation.event('signal_pattern', sensor=1, first_break_frame=int(first_break_frame),
+                          end_break_frame=int(end_break_frame))
+
+    first_breaks, peaks, signal_pattern = np.empty(data_source.n_traces), np.empty(data_source.n_traces), None
+    workspace = Workspace()
+    for start, block in data_source.iter_trace_blocks(block_size):
+        with instrumentation.stage('normalization', traces=len(block)):
+            normalized_block = _normalize_to_buffer(block, dtype, workspace)
+        if noise_type:
+            with instrumentation.stage('noise', traces=len(block)):
+                add_noise(normalized_block, snr_db=snr_db, noise_type=noise_type, fs=data_source.fs, rng=rng,
+                          out=normalized_block, workspace=workspace)
+        if signal_pattern is None:
+            # copied, the next blocks overwrite the buffer
+            signal_pattern = normalized_block[:1, first_break_frame:end_break_frame].copy()
+        first_breaks[start:start + len(block)], peaks[start:start + len(block)] = pick_gather(
+            normalized_block, first_break_frame, end_break_frame, data_source.fs, signal_pattern=signal_pattern,
+            return_peak=True, dtype=dtype)
+    if return_peaks:
+        return first_breaks, peaks
+    return first_breaks
+
+def gather_object_picking_algorithm(gather, noise_type="", snr_db=2, pattern_method="sta_lta"):
+    """
+    gather_picking_algorithm on a Gather (code_section.gather) that is already normalized.
+    The noise is added to the gather buffer in place and the picks are saved in gather.picks.
+
+    Returns:
+        The gather.
+    """
+    first_break_frame, end_break_frame = gather_signal_pattern_range(gather.raw_data(slice(0, 1)),
+                                                                     gather.sampling_rate, pattern_method)
+    instrumentation.event('signal_pattern', sensor=1, first_break_frame=int(first_break_frame),
+                          end_break_frame=int(end_break_frame))
+
+    if noise_type:
+        with instrumentation.stage('noise', traces=len(gather)):
+            add_noise(gather.data, snr_db=snr_db, noise_type=noise_type, fs=gather.sampling_rate, out=gather.data)
+        gather.noise_type = noise_type
+
+    gather.set_picks(pick_gather(gather.data, first_break_frame, end_break_frame, gather.sampling_rate,
+                                 dtype=gather.data.dtype))
+    return gather
+
+def template_bank_picking_algorithm(gather, noise_type="", snr_db=2, templates=None, channel_events=None,
+                                    pattern_length=450, pilot_trace=0):
+    """
+    Multisource variation of full_picking_algorithm2 on a Gather (code_section.gather) that is already normalized:
+    all the source events are picked with one TemplateBank pass over the gather instead of one pass per event.
+    By default the templates are pattern_length samples from the AIC pick of every event of the pilot trace
+    (the events of detect_channel_events), sliced after the noise as in full_picking_algorithm2.
+    With channel_events, template j is searched only in event j of each trace (the full trace when the trace has
+    less events), user templates without channel_events are searched in the full traces.
+    The noise is added to the gather buffer in place and the picks (one per trace and template, with the
+    normalized peak as score) are saved in gather.picks.
+
+    Returns:
+        (n_traces, n_templates) arrays of the first break times (seconds, nan when not found) and the scores.
+    """
+    fs, n_samples = gather.sampling_rate, gather.n_samples
+    if templates is None:
+        if channel_events is None:
+            channel_events = detect_channel_events(gather.data, fs)
+        pilot_events = channel_events.ranges(pilot_trace)
+        assert len(pilot_events), "No source event was found in the pilot trace"
+        with instrumentation.stage('aic', traces=len(pilot_events)):
+            template_starts = [start + int(aic_pick(gather.data[pilot_trace, start:end])) for start, end in pilot_events]
+        template_ranges = [(start, min(start + pattern_length, end)) for start, (_, end) in
+                           zip(template_starts, pilot_events)]
+        instrumentation.event('template_bank', pilot_trace=pilot_trace,
+                              template_ranges=[[int(start), int(end)] for start, end in template_ranges])
+
+    if noise_type:
+        with instrumentation.stage('noise', traces=len(gather)):
+            add_noise(gather.data, snr_db=snr_db, noise_type=noise_type, fs=fs, out=gather.data)
+        gather.noise_type = noise_type
+
+    if templates is None:
+        templates = [gather.data[pilot_trace, start:end].copy() for start, end in template_ranges]
+    bank = TemplateBank(templates, dtype=gather.data.dtype)
+
+    windows = None
+    if channel_events is not None:
+        # the lags of template j are the event j alignments (the template inside the event), or the full trace
+        n_lags = n_samples - bank.template_lengths.max() + 1
+        windows = np.tile([0, n_lags], (len(gather), bank.n_templates, 1))
+        for trace_index in range(len(gather)):
+            events = channel_events.ranges(trace_index)[:bank.n_templates]
+            windows[trace_index, :len(events), 0] = events[:, 0]
+            windows[trace_index, :len(events), 1] = np.minimum(events[:, 1] - bank.template_lengths[:len(events)] + 1,
+                                                               n_lags)
+
+    with instrumentation.stage('correlation', traces=len(gather), templates=bank.n_templates):
+        lags, scores = bank.pick(gather.data, return_peak=True, windows=windows)
+    first_breaks = np.where(lags >= 0, lags / fs, np.nan)
+
+    found = lags >= 0
+    gather.picks = np.empty(0, dtype=gather.picks.dtype)
+    gather.add_picks(np.nonzero(found)[0], first_breaks[found], scores[found])
+    return first_breaks, scores
+
+def moveout_picking_algorithm(sensors_data, sensors_geometry_data, sensors_sample_rate, sensors_length=None,
+                              noise_type="", snr_db=2, pattern_method="sta_lta", model="linear",
+                              search_half_width=0.05, seed_traces=8, block_size=8, picker="correlation",
+                              min_inliers_ratio=0.5):
+    """
+    gather_picking_algorithm that searches each trace only around its predicted arrival.
+    The traces are picked from the first sensor outward: the seed_traces nearest ones on the full trace, then
+    every block of block_size traces inside +-search_half_width seconds of the arrival predicted by a
+    moveout model (see code_section.moveout) fitted on the geometry and all the picks made so far.
+    The fit ignores the picks that disagree with the moveout of the others, and while less than
+    min_inliers_ratio of the picks agree the next block is picked on the full traces.
+    picker 'correlation' is the pilot cross-correlation peak (its fit is weighted by the correlation peaks)
+    and 'aic' is the AIC picker.
+
+    Returns:
+        Array of the first break time (seconds) of each sensor.
+    """
+    sensors_data = np.asarray(sensors_data)
+    if sensors_length is not None:
+        sensors_data = sensors_data[:sensors_length]
+    assert len(sensors_data), "Sensors data is empty!"
+    if picker not in ("correlation", "aic"):
+        raise ValueError("picker must be 'correlation' or 'aic'")
+
+    with instrumentation.stage('normalization', traces=len(sensors_data)):
+        normalized_data = normalize_gather(sensors_data)
+    first_break_frame, end_break_frame = gather_signal_pattern_range(sensors_data, sensors_sample_rate,
+                                                                     pattern_method)
+    if noise_type:
+        with instrumentation.stage('noise', traces=len(normalized_data)):
+            normalized_data = add_noise(normalized_data, snr_db=snr_db, noise_type=noise_type, fs=sensors_sample_rate)
+    # as in the per-sensor algorithms, the pattern is sliced from the (noised) first sensor data
+    correlator = PilotCorrelator(normalized_data[0, first_break_frame:end_break_frame])
+
+    n_traces, n_samples = normalized_data.shape
+    n_positions = n_samples - correlator.pattern_length + 1 if picker == "correlation" else n_samples
+    offsets = spread_offsets(np.asarray(sensors_geometry_data, dtype=float)[:n_traces])
+    order = np.argsort(np.abs(offsets), kind='stable')
+    half_width = int(search_half_width * sensors_sample_rate)
+    arrivals, weights = np.empty(n_traces), np.ones(n_traces)
+
+    def pick(traces, windows):
+        if picker == "aic":
+            with instrumentation.stage('aic', traces=len(traces)):
+                return aic_pick_batch(normalized_data[traces], windows), np.ones(len(traces))
+        with instrumentation.stage('correlation', traces=len(traces)):
+            if windows is None:
+                lags, peaks = correlator.pick(normalized_data[traces], return_peak=True)
+            else:
+                lags, peaks = correlator.pick_windows(normalized_data[traces], windows, return_peak=True)
+        return lags, np.maximum(peaks, 1e-3)
+
+    picked = order[:max(seed_traces, 3 if model == "hyperbolic" else 2)]
+    arrivals[picked], weights[picked] = pick(picked, None)
+    coefficients = None
+    for start in range(len(picked), n_traces, block_size):
+        traces = order[start:start + block_size]
+        try:
+            coefficients, inliers = fit_moveout(offsets[picked], arrivals[picked], model, weights=weights[picked],
+                                                max_residual=half_width / 2, return_inliers=True)
+            windows = moveout_windows(predict_moveout(coefficients, offsets[traces], model), half_width, n_positions)
+        except ValueError:
+            # the picked offsets repeat too much to determine the model (e.g. sensors at the same position)
+            inliers, windows = np.zeros(1, dtype=bool), None
+        if np.mean(inliers) < min_inliers_ratio:
+            # most of the picks so far don't agree on a moveout, so there is no prediction to trust yet
+            windows = None
+            instrumentation.count('moveout_full_trace_blocks')
+        arrivals[traces], weights[traces] = pick(traces, windows)
+        picked = order[:start + len(traces)]
+
+    instrumentation.event('moveout', model=model, coefficients=None if coefficients is None else
+                          [float(coefficient) for coefficient in coefficients])
+    return arrivals / sensors_sample_rate
+
+def tiered_picking_algorithm(sensors_data, sensors_sample_rate, sensors_length=None, noise_type="", snr_db=2,
+                             pattern_method="sta_lta", min_sta_lta_margin=1.0, min_aic_sharpness=0.8,
+                             min_onset_power_ratio=4.0, pilot_length=0.1, repick_half_width=None, workspace=None):
+    """
+    Onset picking with an early exit and a quality for every pick (see code_section.quality).
+    Tier 0 (cheap): the AIC picker inside the STA/LTA break range of each trace (from one STA group before it).
+    The pick is accepted when its STA/LTA margin, AIC sharpness and onset power ratio (over one LTA group) clear
+    min_sta_lta_margin, min_aic_sharpness and min_onset_power_ratio - a trigger on the coda of the arrival or on
+    the trace end is escalated.
+    Tier 1: only the other traces are cross-correlated with a pilot of pilot_length seconds from the onset of the
+    sharpest accepted trace (the first sensor signal pattern when no trace is accepted), and re-picked with AIC
+    in repick_half_width samples (2 STA groups by default) around the onset the correlation predicts.
+    With a Workspace (code_section.workspace) the normalized and noised data, the STA/LTA and the AIC stages
+    reuse its buffers across calls (the correlation spectra of scipy.fft are always new arrays).
+
+    Returns:
+        Array of the first break time (seconds) of each sensor and its PICK_QUALITY_DTYPE quality array.
+    """
+    sensors_data = np.asarray(sensors_data)
+    if sensors_length is not None:
+        sensors_data = sensors_data[:sensors_length]
+    assert len(sensors_data), "Sensors data is empty!"
+    n_traces, n_samples = sensors_data.shape
+    sta_group_size = STA_LTA_PARAMS['sta_group_size']
+
+    def aic_windows(centers, before, after):
+        start = np.clip(centers - before, 0, n_samples - 3)
+        return np.stack([start, np.clip(centers + after, start + 3, n_samples)], axis=-1)
+
+    with instrumentation.stage('normalization', traces=n_traces):
+        # the buffer has the normalize_gather dtype (float32 data stays float32)
+        normalized_data = normalize_gather(sensors_data) if workspace is None else _normalize_to_buffer(
+            sensors_data, sensors_data.dtype if np.issubdtype(sensors_data.dtype, np.floating) else None, workspace)
+    if noise_type:
+        with instrumentation.stage('noise', traces=n_traces):
+            if workspace is None:
+                normalized_data = add_noise(normalized_data, snr_db=snr_db, noise_type=noise_type,
+                                            fs=sensors_sample_rate)
+            else:
+                add_noise(normalized_data, snr_db=snr_db, noise_type=noise_type, fs=sensors_sample_rate,
+                          out=normalized_data, workspace=workspace)
+
+    quality = np.zeros(n_traces, dtype=PICK_QUALITY_DTYPE)
+    quality['correlation_peak'] = quality['peak_ratio'] = np.nan
+
+    # Tier 0: STA/LTA + AIC on every trace
+    ratio = None if workspace is None else workspace.get('sta_lta_ratio', (n_traces, n_samples))
+    with instrumentation.stage('sta_lta', traces=n_traces):
+        ratio = sta_lta_gather(normalized_data, sta_group_size, STA_LTA_PARAMS['lta_group_size'], out=ratio,
+                               workspace=workspace)
+        first_break_frames, end_break_frames = find_break_ranges(ratio, STA_LTA_PARAMS['threshold'],
+                                                                 max_gap=int(0.1 * sensors_sample_rate))
+    windows = aic_windows(first_break_frames, sta_group_size, end_break_frames - first_break_frames + 1)
+    with instrumentation.stage('aic', traces=n_traces):
+        picks, aic_curves = aic_pick_batch(normalized_data, windows, return_curve=True, workspace=workspace)
+    quality['sta_lta_margin'] = sta_lta_margin(ratio, first_break_frames, end_break_frames,
+                                               STA_LTA_PARAMS['threshold'],
+                                               edge=STA_LTA_PARAMS['lta_group_size'] // 2)
+    quality['aic_sharpness'] = quality['score'] = aic_sharpness(aic_curves, picks - windows[:, 0] - 1)
+    quality['onset_power_ratio'] = onset_power_ratio(normalized_data, picks, STA_LTA_PARAMS['lta_group_size'])
+
+    accepted = (quality['sta_lta_margin'] >= min_sta_lta_margin) & \
+        (quality['aic_sharpness'] >= min_aic_sharpness) & (quality['onset_power_ratio'] >= min_onset_power_ratio)
+    escalated = np.flatnonzero(~accepted)
+    instrumentation.count('tier0_picks', n_traces - len(escalated))
+    instrumentation.count('tier1_picks', len(escalated))
+    if len(escalated):
+        # Tier 1: the pilot correlation predicts the onset of the ambiguous traces only
+        if np.any(accepted):
+            pilot_trace = np.flatnonzero(accepted)[np.argmax(quality['aic_sharpness'][accepted])]
+            pattern_start = max(picks[pilot_trace] - sta_group_size, 0)
+            pattern_end = min(picks[pilot_trace] + int(pilot_length * sensors_sample_rate), n_samples)
+        else:
+            # as in the per-sensor algorithms, the pattern is sliced from the (noised) first sensor data
+            pilot_trace = 0
+            pattern_start, pattern_end = gather_signal_pattern_range(sensors_data, sensors_sample_rate,
+                                                                     pattern_method)
+        correlator = PilotCorrelator(normalized_data[pilot_trace, pattern_start:pattern_end])
+        with instrumentation.stage('correlation', traces=len(escalated)):
+            lags, peaks, peak_ratios = correlator.pick_quality(normalized_data[escalated])
+        predicted = lags + picks[pilot_trace] - pattern_start
+        half_width = 2 * sta_group_size if repick_half_width is None else repick_half_width
+        with instrumentation.stage('aic', traces=len(escalated)):
+            picks[escalated] = aic_pick_batch(normalized_data[escalated],
+                                              aic_windows(predicted, half_width, half_width), workspace=workspace)
+        quality['tier'][escalated] = 1
+        quality['correlation_peak'][escalated] = peaks
+        quality['peak_ratio'][escalated] = peak_ratios
+        quality['score'][escalated] = np.clip(peaks, 0, 1)
+
+    return picks / sensors_sample_rate, quality
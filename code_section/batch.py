@@ -0,0 +1,203 @@
+"""
+Batch processing of many shot files on a worker pool, without plotting.
+
+    python -m code_section.batch "shots/*.mat" --output picks.npz --workers 8
+    python -m code_section.batch --manifest shots.txt --output picks.csv --noise-type white --snr-db 5
+    python -m code_section.batch "shots/*.sgy" --output picks.npz --n-samples 4000 --fs 2000 --dtype '>f4' \\
+        --file-header-bytes 3600 --trace-header-bytes 240
+
+Every finished shot is saved to <output>.parts/ right away, so an interrupted run continues from the shots
+that were not processed yet (a run with other picking or raw binary parameters, or another --seed, writes other
+parts). At the end all the parts are merged to one columnar output file (one row per trace): .npz (column
+arrays) or .csv.
+With --instrument (or PICKING_INSTRUMENT) every shot is an instrumented run in its worker, --profile and
+--trace-memory add the cProfile and tracemalloc records to its summary.
+The noise of every shot comes from its own generator, seeded by --seed and the shot file path, so the workers
+never share the noise of the global np.random state.
+"""
+import os
+import sys
+import csv
+import glob
+import hashlib
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from code_section.utils.data_sources import open_data_source
+from code_section.algorithms import data_source_picking_algorithm
+from code_section.instrumentation import get_instrumentation, configure, add_instrumentation_arguments, \
+    configure_from_arguments, maybe_instrumented_run
+
+OUTPUT_COLUMNS = ["shot_file", "trace", "first_break_time", "correlation_peak", "shot_median_peak"]
+OUTPUT_EXTENSIONS = (".npz", ".csv")
+
+instrumentation = get_instrumentation()
+
+
+def collect_shot_files(patterns=(), manifest_path=None):
+    """
+    The sorted unique shot files of the glob patterns and the manifest (one path per line, # for comments).
+    """
+    shot_files = []
+    for pattern in patterns:
+        shot_files.extend(glob.glob(pattern, recursive=True))
+    if manifest_path:
+        with open(manifest_path) as manifest_file:
+            shot_files.extend(line.strip() for line in manifest_file if line.strip() and not line.startswith("#"))
+    return sorted(set(os.path.abspath(shot_file) for shot_file in shot_files))
+
+
+def params_key(picking_params, raw_binary_params, seed=None):
+    """
+    A digest of everything the picks of a shot depend on besides its file, part of the part file names.
+    """
+    params = repr((sorted(picking_params.items()), sorted(raw_binary_params.items()), seed))
+    return hashlib.sha1(params.encode()).hexdigest()[:16]
+
+
+def _part_path(parts_dir, shot_file, key):
+    return os.path.join(parts_dir, f"{hashlib.sha1(shot_file.encode()).hexdigest()}-{key}.npz")
+
+
+def shot_seed(entropy, shot_file):
+    """
+    The noise seed of a shot: the run entropy and the shot file path, so it does not depend on the worker or the
+    order the shots are processed in.
+    """
+    return np.random.SeedSequence([entropy, int(hashlib.sha1(shot_file.encode()).hexdigest(), 16)])
+
+
+def process_shot(shot_file, parts_dir, picking_params, raw_binary_params, key, seed=None):
+    """
+    Pick one shot and save its picks and QC metrics to its part file (atomically).
+    :param seed: the np.random.SeedSequence (or int) of the shot noise generator.
+    """
+    with maybe_instrumented_run(), open_data_source(shot_file, **raw_binary_params) as data_source:
+        instrumentation.event('shot', shot_file=shot_file, n_traces=data_source.n_traces, pid=os.getpid())
+        first_breaks, peaks = data_source_picking_algorithm(data_source, return_peaks=True,
+                                                            rng=np.random.default_rng(seed), **picking_params)
+
+    part_path = _part_path(parts_dir, shot_file, key)
+    temp_path = part_path + ".tmp.npz"
+    np.savez(temp_path, shot_file=shot_file, first_break_time=first_breaks, correlation_peak=peaks)
+    os.replace(temp_path, part_path)
+    return shot_file
+
+
+def merge_parts(shot_files, parts_dir, output_path, key):
+    """
+    Merge the part files (of the parameters key) of the shots to one columnar output, one row per trace:
+    .csv, or .npz written to output_path as is for any other name.
+    """
+    columns = {column: [] for column in OUTPUT_COLUMNS}
+    for shot_file in shot_files:
+        part_path = _part_path(parts_dir, shot_file, key)
+        if not os.path.exists(part_path):
+            continue
+        with np.load(part_path) as part:
+            n_traces = len(part['first_break_time'])
+            columns['shot_file'].append(np.full(n_traces, shot_file))
+            columns['trace'].append(np.arange(n_traces))
+            columns['first_break_time'].append(part['first_break_time'])
+            columns['correlation_peak'].append(part['correlation_peak'])
+            columns['shot_median_peak'].append(np.full(n_traces, np.median(part['correlation_peak'])))
+    columns = {column: np.concatenate(values) if values else np.empty(0) for column, values in columns.items()}
+
+    if output_path.lower().endswith(".csv"):
+        with open(output_path, "w", newline="") as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(OUTPUT_COLUMNS)
+            writer.writerows(zip(*(columns[column] for column in OUTPUT_COLUMNS)))
+    else:
+        # a file object, np.savez appends .npz to a path without it
+        with open(output_path, "wb") as output_file:
+            np.savez(output_file, **columns)
+    return columns
+
+
+def run_batch(shot_files, output_path, workers=None, picking_params=None, raw_binary_params=None, seed=None,
+              instrument_options=None):
+    """
+    Pick all the shots that have no part file of these parameters yet on a process pool and merge the output.
+    :param seed: int seed of the noise (with the shot file path), fresh entropy every run by default.
+    :param instrument_options: instrumentation.configure arguments for every worker (the workers inherit the
+        PICKING_INSTRUMENT setup by default).
+
+    Returns:
+        List of (shot_file, error) of the shots that failed.
+    """
+    picking_params, raw_binary_params = picking_params or {}, raw_binary_params or {}
+    key = params_key(picking_params, raw_binary_params, seed)
+    entropy = np.random.SeedSequence(seed).entropy
+    parts_dir = output_path + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    pending = [shot_file for shot_file in shot_files if not os.path.exists(_part_path(parts_dir, shot_file, key))]
+    print(f"{len(shot_files)} shots, {len(shot_files) - len(pending)} already processed, {len(pending)} to process")
+
+    failures = []
+    initializer, initargs = (configure, (instrument_options['spec'], instrument_options['profile'],
+                                         instrument_options['trace_memory'])) if instrument_options else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(process_shot, shot_file, parts_dir, picking_params, raw_binary_params, key,
+                                   shot_seed(entropy, shot_file)): shot_file
+                   for shot_file in pending}
+        for done_num, future in enumerate(as_completed(futures), start=1):
+            try:
+                future.result()
+                print(f"[{done_num}/{len(pending)}] {futures[future]}")
+            except Exception as error:
+                failures.append((futures[future], repr(error)))
+                print(f"[{done_num}/{len(pending)}] FAILED {futures[future]}: {error!r}")
+
+    merge_parts(shot_files, parts_dir, output_path, key)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pick the first breaks of many shot files")
+    parser.add_argument("patterns", nargs="*", help="glob patterns of the shot files")
+    parser.add_argument("--manifest", help="text file with a shot file path in each line")
+    parser.add_argument("--output", required=True, help="output file, .npz or .csv")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--noise-type", default="", choices=["", "white", "pink"])
+    parser.add_argument("--snr-db", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=None, help="seed of the noise, for reproducible runs")
+    parser.add_argument("--pattern-method", default="sta_lta", choices=["sta_lta", "aic"])
+    parser.add_argument("--block-size", type=int, default=256, help="traces read from the file at once")
+    raw_binary = parser.add_argument_group("raw binary (SEG-Y-like) files")
+    raw_binary.add_argument("--n-samples", type=int)
+    raw_binary.add_argument("--fs", type=float)
+    raw_binary.add_argument("--dtype", default="<f4")
+    raw_binary.add_argument("--file-header-bytes", type=int, default=0)
+    raw_binary.add_argument("--trace-header-bytes", type=int, default=0)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.n_samples is not None and args.fs is None:
+        parser.error("--fs is required with --n-samples (raw binary files have no sampling rate)")
+    if not args.output.lower().endswith(OUTPUT_EXTENSIONS):
+        parser.error(f"--output must end with one of {', '.join(OUTPUT_EXTENSIONS)}")
+    instrument_options = configure_from_arguments(args)
+
+    shot_files = collect_shot_files(args.patterns, args.manifest)
+    if not shot_files:
+        parser.error("no shot files found")
+
+    picking_params = {'noise_type': args.noise_type, 'snr_db': args.snr_db,
+                      'pattern_method': args.pattern_method, 'block_size': args.block_size}
+    raw_binary_params = {}
+    if args.n_samples is not None:
+        raw_binary_params = {'n_samples': args.n_samples, 'fs': args.fs, 'dtype': args.dtype,
+                             'file_header_bytes': args.file_header_bytes,
+                             'trace_header_bytes': args.trace_header_bytes}
+
+    failures = run_batch(shot_files, args.output, args.workers, picking_params, raw_binary_params, args.seed,
+                         instrument_options)
+    if failures:
+        print(f"{len(failures)} of {len(shot_files)} shots failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
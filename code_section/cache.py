@@ -0,0 +1,96 @@
+import os
+import json
+import uuid
+import hashlib
+import numpy as np
+
+from code_section.consts import CACHE_DIR, CACHE_MAX_SIZE_BYTES, CACHE_VERSION
+
+
+class ResultCache:
+    """
+    Content-addressed disk cache for the intermediate products of the pipeline (arrays dict per key).
+    The key is a hash of the input arrays, the parameters and CACHE_VERSION, so the same data with the same
+    parameters is computed once and loaded in the next runs, until the algorithms version changes.
+    When the cache directory is larger than max_size_bytes the least recently used entries are deleted.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_size_bytes=CACHE_MAX_SIZE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*arrays, **params) -> str:
+        """
+        Hash of CACHE_VERSION, the arrays content (with their dtype and shape) and the JSON of the parameters.
+        """
+        digest = hashlib.sha256(f"version={CACHE_VERSION};".encode())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.data)
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """
+        The cached products dict of the key, or None when it is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as products:
+                products = {name: products[name] for name in products.files}
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        os.utime(path)  # mark as recently used
+        return products
+
+    def put(self, key, products):
+        """
+        Save the products dict of arrays, the file is replaced atomically so a crash doesn't leave a broken entry.
+        """
+        temp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.tmp.npz")
+        np.savez(temp_path, **products)
+        os.replace(temp_path, self._path(key))
+        self._evict(keep_key=key)
+
+    def get_or_compute(self, key, compute_function):
+        """
+        The cached products of the key, compute_function() computes and saves them when missing.
+        """
+        products = self.get(key)
+        if products is None:
+            products = compute_function()
+            self.put(key, products)
+        return products
+
+    def _evict(self, keep_key=None):
+        """
+        Delete the least recently used entries until the cache is smaller than max_size_bytes,
+        the entry of keep_key (the one just written) is never deleted.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".npz") and not file_name.startswith("."):
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if file_name == f"{keep_key}.npz":
+                continue
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, file_name))
@@ -1,10 +1,17 @@
+import os
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
 DATA_FILES = [
-    r"C:\dev\picking-finder\data\simulation_ricker.mat",
-    "C:\dev\picking-finder\data\simulation_continuous.mat",
-    "C:\dev\picking-finder\data\simulation_multisource.mat"
+    os.path.join(DATA_DIR, "simulation_ricker.mat"),
+    os.path.join(DATA_DIR, "simulation_continuous.mat"),
+    os.path.join(DATA_DIR, "simulation_multisource.mat")
 ]
 SENSOR_NUMBER_SIZE = 64
 SNR_RATIO_DB = [x for x in range(-5,15)]
 NOISE_TYPES = ["white", "pink"]
 STA_LTA_PARAMS = {'sta_group_size': 30, 'lta_group_size': 90, 'threshold': 1.75}
 
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "picking-finder")
+CACHE_MAX_SIZE_BYTES = 2 * 1024 ** 3
+# Part of every cache key: bump it when a change of the algorithms changes the cached products
+CACHE_VERSION = 1
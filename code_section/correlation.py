@@ -0,0 +1,188 @@
+import numpy as np
+from scipy import fft as sp_fft
+from numpy.lib.stride_tricks import sliding_window_view
+
+from code_section.quality import peak_ratio
+
+
+class PilotCorrelator:
+    """
+    Cross-correlation of many traces with one signal pattern (pilot).
+    The conjugate FFT of the pattern is computed once per FFT length and cached, so correlating more traces or
+    more noise realizations only costs the FFT of the traces.
+    Traces longer than block_size samples are correlated with overlap-save on blocks of block_size samples.
+    dtype np.float32 keeps float32 traces in single precision through the FFTs (half the memory traffic).
+    """
+    def __init__(self, signal_pattern, block_size=16384, dtype=np.float64):
+        self.signal_pattern = np.asarray(signal_pattern, dtype=dtype)
+        self.pattern_length = self.signal_pattern.shape[-1]
+        assert self.pattern_length > 0, "The signal pattern is empty"
+        self.pattern_energy = np.sqrt(np.sum(self.signal_pattern ** 2, axis=-1, keepdims=True))
+        self.block_size = max(block_size, 2 * self.pattern_length)
+        self._spectrum_cache = {}
+
+    def _pattern_spectrum(self, nfft):
+        """
+        The cached conjugate spectrum of the pattern for FFT length nfft.
+        """
+        if nfft not in self._spectrum_cache:
+            self._spectrum_cache[nfft] = np.conj(sp_fft.rfft(self.signal_pattern, n=nfft, axis=-1))
+        return self._spectrum_cache[nfft]
+
+    def correlate(self, traces):
+        """
+        Cross-correlation between the pattern and each trace (last axis), returning only the valid alignments
+        (n_samples - pattern length + 1 values), as scipy.signal.correlate(trace, pattern, mode='valid').
+        The pattern leading dimensions are broadcast with the traces leading dimensions.
+        """
+        traces = np.asarray(traces)
+        n_samples = traces.shape[-1]
+        assert n_samples >= self.pattern_length, "The full data must be the longer then the signal"
+        n_lags = n_samples - self.pattern_length + 1
+
+        if n_samples <= self.block_size:
+            nfft = sp_fft.next_fast_len(n_samples, real=True)
+            spectrum = sp_fft.rfft(traces, n=nfft, axis=-1) * self._pattern_spectrum(nfft)
+            return sp_fft.irfft(spectrum, n=nfft, axis=-1)[..., :n_lags]
+
+        # Overlap-save: every block of nfft samples gives nfft - pattern length + 1 valid lags
+        nfft = sp_fft.next_fast_len(self.block_size, real=True)
+        step = nfft - self.pattern_length + 1
+        n_blocks = -(-n_lags // step)
+        pad_width = [(0, 0)] * (traces.ndim - 1) + [(0, (n_blocks - 1) * step + nfft - n_samples)]
+        blocks = sliding_window_view(np.pad(traces, pad_width), nfft, axis=-1)[..., ::step, :]
+        spectrum = sp_fft.rfft(blocks, axis=-1) * self._pattern_spectrum(nfft)[..., None, :]
+        correlation_result = sp_fft.irfft(spectrum, n=nfft, axis=-1)[..., :step]
+        return correlation_result.reshape(correlation_result.shape[:-2] + (-1,))[..., :n_lags]
+
+    def pick(self, traces, return_peak=False):
+        """
+        Find the lag (sample) of the peak correlation of each trace.
+        :param return_peak: return also the peak normalized by the pattern and trace window energies
+                            (1 for a window identical in shape to the pattern).
+        """
+        traces = np.asarray(traces)
+        correlation_result = self.correlate(traces)
+        lags = np.argmax(correlation_result, axis=-1)
+        if not return_peak:
+            return lags
+        return lags, self._normalized_peaks(traces, correlation_result, lags)
+
+    def pick_quality(self, traces, exclusion=None):
+        """
+        pick with the quality of each pick.
+        :param exclusion: lags around the peak that are not taken as the second peak, pattern length / 4 by default.
+        :return: (lags, normalized peaks, peak-to-second-peak ratios (see code_section.quality.peak_ratio)).
+        """
+        traces = np.asarray(traces)
+        correlation_result = self.correlate(traces)
+        lags = np.argmax(correlation_result, axis=-1)
+        exclusion = self.pattern_length // 4 if exclusion is None else exclusion
+        return lags, self._normalized_peaks(traces, correlation_result, lags), \
+            peak_ratio(correlation_result, lags, exclusion)
+
+    def _normalized_peaks(self, traces, correlation_result, lags):
+        """
+        The peaks normalized by the pattern and trace window energies.
+        """
+        peaks = np.take_along_axis(correlation_result, lags[..., None], axis=-1)[..., 0]
+        cumsq = np.cumsum(traces.astype(float) ** 2, axis=-1)
+        window_end = np.take_along_axis(cumsq, (lags + self.pattern_length - 1)[..., None], axis=-1)[..., 0]
+        window_start = np.where(lags > 0, np.take_along_axis(cumsq, np.maximum(lags - 1, 0)[..., None], axis=-1)[..., 0], 0)
+        window_energy = np.sqrt(np.maximum(window_end - window_start, 0))
+        return peaks / (self.pattern_energy[..., 0] * window_energy + 1e-12)
+
+    def pick_windows(self, traces, windows, return_peak=False):
+        """
+        pick with the lags of each trace limited to its own window, only the samples under the window are
+        correlated.
+        :param traces: array (n_traces, n_samples).
+        :param windows: array (n_traces, 2) of [start, end) lag ranges, all of the same length.
+        :return: the lags from the start of the traces (and the normalized peaks as in pick).
+        """
+        traces, windows = np.asarray(traces), np.asarray(windows, dtype=np.int64)
+        starts, n_lags = windows[:, 0], windows[0, 1] - windows[0, 0]
+        assert np.all(windows[:, 1] - starts == n_lags), "The windows must have the same length"
+        assert np.all(starts >= 0) and np.all(windows[:, 1] + self.pattern_length - 1 <= traces.shape[-1]), \
+            "Invalid correlation windows"
+        segments = np.take_along_axis(traces, starts[:, None] + np.arange(n_lags + self.pattern_length - 1), axis=-1)
+        if not return_peak:
+            return starts + self.pick(segments)
+        lags, peaks = self.pick(segments, return_peak=True)
+        return starts + lags, peaks
+
+
+class TemplateBank(PilotCorrelator):
+    """
+    Cross-correlation of many traces with a bank of templates (one pilot per source event) in one pass:
+    the FFT of every trace is computed once and multiplied by the cached spectra of all the templates.
+    Templates of different lengths are zero padded to the longest one, so the lags of every template are
+    limited to n_samples - longest template length + 1.
+    """
+    def __init__(self, templates, block_size=16384, dtype=np.float64):
+        templates = [np.asarray(template, dtype=dtype) for template in templates]
+        assert len(templates) and all(len(template) for template in templates), "The template bank is empty"
+        self.template_lengths = np.array([len(template) for template in templates])
+        bank = np.zeros((len(templates), self.template_lengths.max()), dtype=dtype)
+        for row, template in zip(bank, templates):
+            row[:len(template)] = template
+        super().__init__(bank, block_size=block_size, dtype=dtype)
+
+    @property
+    def n_templates(self):
+        return len(self.template_lengths)
+
+    def correlate(self, traces):
+        """
+        Cross-correlation of every trace with every template, (n_traces, n_templates, n_lags).
+        """
+        return super().correlate(np.asarray(traces)[..., None, :])
+
+    def pick(self, traces, return_peak=False, windows=None):
+        """
+        Find the lag of the peak correlation of every (trace, template) pair.
+        :param traces: array (n_traces, n_samples).
+        :param return_peak: return also the peaks normalized by the template and trace window energies.
+        :param windows: optional (n_traces, n_templates, 2) [start, end) lag ranges of the search (for example the
+                        event ranges of each trace), clipped to the valid lags. Only the samples under the windows
+                        are correlated, so disjoint windows cost about one pass over the traces for all the
+                        templates. An empty window gives lag -1.
+        :return: (n_traces, n_templates) lags (and normalized peaks, nan for the empty windows).
+        """
+        traces = np.asarray(traces)
+        if windows is None:
+            correlation_result = self.correlate(traces)
+            starts, widths = 0, correlation_result.shape[-1]
+        else:
+            # one (n_traces, n_templates) batch of the window segments, padded to the widest window
+            windows = np.asarray(windows, dtype=np.int64)
+            n_lags = traces.shape[-1] - self.pattern_length + 1
+            starts = np.clip(windows[..., 0], 0, n_lags)
+            widths = np.clip(windows[..., 1], starts, n_lags) - starts
+            positions = np.arange(max(widths.max(), 1) + self.pattern_length - 1)
+            segments = np.take_along_axis(traces[:, None, :], np.minimum(starts[..., None] + positions,
+                                                                         traces.shape[-1] - 1), axis=-1)
+            correlation_result = super().correlate(segments)
+            correlation_result[np.arange(correlation_result.shape[-1]) >= widths[..., None]] = -np.inf
+
+        local_lags = np.argmax(correlation_result, axis=-1)
+        peaks = np.take_along_axis(correlation_result, local_lags[..., None], axis=-1)[..., 0]
+        found = np.isfinite(peaks) & (widths > 0)
+        lags = np.where(found, starts + local_lags, -1)
+        if not return_peak:
+            return lags
+        return lags, np.where(found, self._normalize_peaks(traces, peaks, np.maximum(lags, 0)), np.nan)
+
+    def _normalized_peaks(self, traces, correlation_result, lags):
+        """
+        The peaks normalized by the energies of each template and the trace window under it.
+        """
+        peaks = np.take_along_axis(correlation_result, lags[..., None], axis=-1)[..., 0]
+        return self._normalize_peaks(traces, peaks, lags)
+
+    def _normalize_peaks(self, traces, peaks, lags):
+        cumsq = np.cumsum(traces.astype(float) ** 2, axis=-1)
+        cumsq = np.concatenate([np.zeros(cumsq.shape[:-1] + (1,)), cumsq], axis=-1)
+        window_energy = np.take_along_axis(cumsq, lags + self.template_lengths, axis=-1) - \
+            np.take_along_axis(cumsq, lags, axis=-1)
+        return peaks / (self.pattern_energy[..., 0] * np.sqrt(np.maximum(window_energy, 0)) + 1e-12)
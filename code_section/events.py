@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class ChannelEventIndex:
+    """
+    The (start, end) sample ranges of the source events of every sensor.
+    The ranges of all the sensors are kept in flat arrays with offsets (the ranges of sensor i are
+    [offsets[i]:offsets[i+1]]), and the segments are returned as views of the gather data.
+    """
+    def __init__(self, starts, ends, offsets):
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+
+    @property
+    def n_sensors(self):
+        return len(self.offsets) - 1
+
+    def event_counts(self):
+        return np.diff(self.offsets)
+
+    def ranges(self, sensor_num) -> np.ndarray:
+        """
+        (n_events, 2) array of the [start, end) sample ranges of the sensor.
+        """
+        events = slice(self.offsets[sensor_num], self.offsets[sensor_num + 1])
+        return np.stack([self.starts[events], self.ends[events]], axis=-1)
+
+    def segments(self, sensors_data, sensor_num):
+        """
+        The events segments of the sensor as views of its data (no copy).
+        """
+        return [sensors_data[sensor_num][start:end] for start, end in self.ranges(sensor_num)]
+
+    def channel_segments(self, sensors_data, channel_num):
+        """
+        The channel_num event segment of every sensor (views), as the per channel input of the pickers.
+        Raises ValueError when a sensor has less than channel_num + 1 events.
+        """
+        missing = np.flatnonzero(self.event_counts() <= channel_num)
+        if len(missing):
+            raise ValueError(f"Sensor {missing[0]} has no event {channel_num} "
+                             f"(it has {self.event_counts()[missing[0]]} events)")
+        return [sensors_data[sensor_num][self.starts[self.offsets[sensor_num] + channel_num]:
+                                         self.ends[self.offsets[sensor_num] + channel_num]]
+                for sensor_num in range(self.n_sensors)]
+
+
+def detect_channel_events(sensors_data, sampling_rate, threshold_magnitude=0.052, nperseg=256, noverlap=128):
+    """
+    Batched separate_channels: the STFT of all the sensors is computed in one call and the ranges where
+    some frequency magnitude is greater than threshold_magnitude are found with run-length logic on all the
+    sensors at once.
+    :param sensors_data: normalized data (n_sensors, n_samples).
+    :return: ChannelEventIndex with the sample ranges (int(time * sampling_rate) of separate_channels times).
+    """
+    from scipy.signal import stft  # scipy.signal is slow to import, only on first use
+    _, time_param, magnitude = stft(sensors_data, fs=sampling_rate, nperseg=nperseg, noverlap=noverlap,
+                                    boundary=None, axis=-1)
+    above_threshold = np.any(np.abs(magnitude) > threshold_magnitude, axis=-2)
+
+    # +1 where a range starts and -1 after it ends, an open range at the end is closed at the last frame
+    n_frames = above_threshold.shape[-1]
+    edges = np.diff(above_threshold.astype(np.int8), axis=-1, prepend=0, append=0)
+    start_sensors, start_frames = np.nonzero(edges == 1)
+    _, end_frames = np.nonzero(edges == -1)
+    end_frames = np.minimum(end_frames, n_frames - 1)
+
+    frame_samples = (time_param * sampling_rate).astype(np.int64)
+    offsets = np.searchsorted(start_sensors, np.arange(len(sensors_data) + 1))
+    return ChannelEventIndex(starts=frame_samples[start_frames], ends=frame_samples[end_frames], offsets=offsets)
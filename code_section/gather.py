@@ -0,0 +1,177 @@
+import numpy as np
+from functools import cached_property
+
+from code_section.sensors import SensorObj
+from code_section.utils.utils import load_mat_file, normalize_gather
+
+PICK_DTYPE = np.dtype([('trace', np.int32), ('time', np.float64), ('score', np.float32)])
+
+
+class GatherTrace(SensorObj):
+    """
+    View of one trace of a Gather with the SensorObj interface.
+    The data, time and geometry are views of the gather arrays (nothing is copied or normalized again),
+    so SensorObj methods that change the data (add_noise) change the gather buffer and its noise_type.
+    """
+    def __init__(self, gather, trace_index):
+        self.gather = gather
+        self.trace_index = trace_index
+        self.sampling_rate = gather.sampling_rate
+
+    @property
+    def noise_type(self):
+        return self.gather.noise_type
+
+    @noise_type.setter
+    def noise_type(self, value):
+        self.gather.noise_type = value
+
+    @property
+    def data(self):
+        return self.gather.data[self.trace_index]
+
+    @data.setter
+    def data(self, value):
+        self.gather.data[self.trace_index] = value
+
+    @property
+    def time(self):
+        return self.gather.time
+
+    @property
+    def geometry_location(self):
+        return self.gather.geometry[self.trace_index]
+
+    @property
+    def first_break_time(self):
+        """
+        The trace pick time as in SensorObj: -1 without picks, float for one pick and a list for multiple picks.
+        """
+        times = self.gather.get_picks(self.trace_index)
+        if len(times) == 0:
+            return -1
+        return float(times[0]) if len(times) == 1 else list(times)
+
+    @first_break_time.setter
+    def first_break_time(self, value):
+        self.gather.remove_picks(self.trace_index)
+        if not np.isscalar(value) or value != -1:
+            self.gather.add_picks(self.trace_index, value)
+
+
+class Gather:
+    """
+    All the traces of a shot in one contiguous (n_traces, n_samples) buffer.
+    * time is computed from the sampling rate on first use and shared by all the traces.
+    * geometry is an (n_traces, 3) array.
+    * picks is a PICK_DTYPE structured array (trace, time, score), a trace can have multiple picks.
+    * trace_mean / trace_std (n_traces, 1) are the normalization of the raw data (raw = data * std + mean).
+    Indexing a gather gives GatherTrace views, so it can be used everywhere a list of SensorObj is used.
+    """
+    def __init__(self, data, sampling_rate, geometry=None, dtype=np.float64, normalize=True):
+        data = np.asarray(data)
+        if normalize:
+            self.trace_mean, self.trace_std = np.mean(data, axis=-1, keepdims=True), np.std(data, axis=-1, keepdims=True)
+            data = normalize_gather(data)
+        else:
+            self.trace_mean, self.trace_std = np.zeros((len(data), 1)), np.ones((len(data), 1))
+        self.data = np.ascontiguousarray(data, dtype=dtype)
+        self.sampling_rate = sampling_rate
+        if geometry is None:
+            geometry = np.zeros((len(self.data), 3))
+        self.geometry = np.asarray(geometry, dtype=np.float64)[:len(self.data)]
+        self.picks = np.empty(0, dtype=PICK_DTYPE)
+        self.noise_type = None
+
+    @classmethod
+    def from_mat_file(cls, mat_path_file, sensors_length=None, dtype=np.float64):
+        sensors_data_dict = load_mat_file(mat_path_file=mat_path_file)
+        return cls(data=sensors_data_dict['data'][:sensors_length], sampling_rate=sensors_data_dict['fs'][0][0],
+                   geometry=sensors_data_dict.get('geometry'), dtype=dtype)
+
+    @classmethod
+    def from_sensors(cls, sensors_list, dtype=np.float64):
+        """
+        Build a gather from a list of SensorObj (their data is already normalized) with their picks.
+        """
+        gather = cls(data=[sensor.data for sensor in sensors_list], sampling_rate=sensors_list[0].sampling_rate,
+                     geometry=[sensor.geometry_location for sensor in sensors_list], dtype=dtype, normalize=False)
+        for trace_index, sensor in enumerate(sensors_list):
+            gather[trace_index].first_break_time = sensor.first_break_time
+        return gather
+
+    @property
+    def n_traces(self):
+        return self.data.shape[0]
+
+    @property
+    def n_samples(self):
+        return self.data.shape[1]
+
+    @cached_property
+    def time(self):
+        return np.arange(self.n_samples) / self.sampling_rate
+
+    def raw_data(self, traces=slice(None)):
+        """
+        The data of the traces before the normalization.
+        """
+        return self.data[traces] * self.trace_std[traces] + self.trace_mean[traces]
+
+    def __len__(self):
+        return self.n_traces
+
+    def __getitem__(self, trace_index) -> GatherTrace:
+        if not -self.n_traces <= trace_index < self.n_traces:
+            raise IndexError("trace index out of range")
+        return GatherTrace(self, trace_index % self.n_traces)
+
+    def __iter__(self):
+        return (GatherTrace(self, trace_index) for trace_index in range(self.n_traces))
+
+    def add_picks(self, traces, times, scores=np.nan):
+        """
+        Add picks, traces / times / scores are scalars or arrays that are broadcast together.
+        """
+        traces, times, scores = np.broadcast_arrays(traces, times, scores)
+        new_picks = np.empty(traces.size, dtype=PICK_DTYPE)
+        new_picks['trace'], new_picks['time'], new_picks['score'] = traces.ravel(), times.ravel(), scores.ravel()
+        self.picks = np.concatenate([self.picks, new_picks])
+
+    def set_picks(self, times, scores=np.nan):
+        """
+        Replace all the picks with one pick per trace.
+        """
+        self.picks = np.empty(0, dtype=PICK_DTYPE)
+        self.add_picks(np.arange(self.n_traces), times, scores)
+
+    def remove_picks(self, trace_index):
+        self.picks = self.picks[self.picks['trace'] != trace_index]
+
+    def get_picks(self, trace_index):
+        """
+        The pick times of the trace, sorted.
+        """
+        return np.sort(self.picks['time'][self.picks['trace'] == trace_index])
+
+    def first_picks(self):
+        """
+        The earliest pick time of each trace (nan when the trace has no pick).
+        """
+        times = np.full(self.n_traces, np.inf)
+        np.minimum.at(times, self.picks['trace'], self.picks['time'])
+        times[np.isinf(times)] = np.nan
+        return times
+
+    def to_sensors(self):
+        """
+        Independent SensorObj list of the gather (copies the data), for code that needs plain SensorObj.
+        """
+        sensors_list = []
+        for trace in self:
+            sensor = SensorObj.__new__(SensorObj)
+            sensor.data, sensor.sampling_rate = trace.data.copy(), self.sampling_rate
+            sensor.time, sensor.geometry_location = self.time, trace.geometry_location.copy()
+            sensor.first_break_time, sensor.noise_type = trace.first_break_time, self.noise_type
+            sensors_list.append(sensor)
+        return sensors_list
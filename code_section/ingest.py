@@ -0,0 +1,446 @@
+"""
+Live ingest of multichannel sample packets with near-real-time first break picking.
+
+    python -m code_section.ingest serve --port 9000 --window 1000
+    python -m code_section.ingest replay --port 9000 --speed 1       # replays simulation_continuous.mat
+    python -m code_section.ingest subscribe --port 9000              # prints the picks as they are published
+
+(--unix PATH instead of --port for a Unix socket, --instrument PATH|log [--profile] [--trace-memory] for the stage
+records and a summary when the command ends.)
+
+Protocol: every frame is a header <2sBI (magic b'PF', message type, payload length) and a little-endian payload.
+    HELLO      source -> server   <Hd (n_channels, sampling rate)
+    SAMPLES    source -> server   <QI (first sample, n_samples) + float32 (n_channels, n_samples) channel-major
+    END        source -> server   empty
+    SUBSCRIBE  client -> server   empty, the server then sends a PICKS frame for every picked window
+    PICKS      server -> client   <IQI (source id, window start, n_picks) + PICK_RECORD_DTYPE records
+
+The packets of a source are written to per-channel ring buffers, and every full window is handed to the picking
+engine on a worker thread. When the picking falls behind, up to max_pending_windows windows wait and then the
+server stops reading the source socket (TCP backpressure). Slow subscribers never block the picking: their
+oldest unsent frames are dropped, so the published picks have bounded latency.
+Lost packets are zero-filled when the gap fits in the ring buffer, a longer gap restarts the source windows at
+the next packet (the windows that are not in the buffer anymore are counted in stats['skipped_windows']).
+"""
+import sys
+import time
+import struct
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from code_section.consts import DATA_FILES
+from code_section.instrumentation import get_instrumentation, add_instrumentation_arguments, \
+    configure_from_arguments, maybe_instrumented_run
+from code_section.utils.utils import load_mat_file, normalize_gather
+from code_section.algorithms import gather_signal_pattern_range, pick_gather
+
+instrumentation = get_instrumentation()
+
+MAGIC = b'PF'
+HEADER = struct.Struct('<2sBI')
+HELLO = struct.Struct('<Hd')
+SAMPLES = struct.Struct('<QI')
+PICKS = struct.Struct('<IQI')
+MSG_HELLO, MSG_SAMPLES, MSG_END, MSG_SUBSCRIBE, MSG_PICKS = 1, 2, 3, 4, 16
+MAX_PAYLOAD_BYTES = 64 * 1024 ** 2
+
+PICK_RECORD_DTYPE = np.dtype([('channel', '<u4'), ('sample', '<u8'), ('score', '<f4')])
+
+
+def encode_frame(message_type, payload=b''):
+    return HEADER.pack(MAGIC, message_type, len(payload)) + payload
+
+
+async def read_frame(reader):
+    """
+    The next (message type, payload) of the stream, None at the end of the stream.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise ConnectionError("Truncated frame header") from error
+        return None
+    magic, message_type, length = HEADER.unpack(header)
+    if magic != MAGIC or length > MAX_PAYLOAD_BYTES:
+        raise ConnectionError("Invalid frame header")
+    return message_type, await reader.readexactly(length)
+
+
+def encode_samples(first_sample, block):
+    block = np.ascontiguousarray(block, dtype='<f4')
+    return encode_frame(MSG_SAMPLES, SAMPLES.pack(first_sample, block.shape[1]) + block.tobytes())
+
+
+def decode_samples(payload, n_channels):
+    """
+    :return: (first sample, block (n_channels, n_samples) float32).
+    """
+    try:
+        first_sample, n_samples = SAMPLES.unpack_from(payload)
+        block = np.frombuffer(payload, dtype='<f4', offset=SAMPLES.size)
+    except (struct.error, ValueError) as error:
+        raise ConnectionError("Malformed samples payload") from error
+    if block.size != n_channels * n_samples:
+        raise ConnectionError("The samples payload does not match its header")
+    return first_sample, block.reshape(n_channels, n_samples)
+
+
+def encode_picks(source_id, window_start, picks):
+    picks = np.asarray(picks, dtype=PICK_RECORD_DTYPE)
+    return encode_frame(MSG_PICKS, PICKS.pack(source_id, window_start, len(picks)) + picks.tobytes())
+
+
+def decode_picks(payload):
+    """
+    :return: (source id, window start, PICK_RECORD_DTYPE records).
+    """
+    source_id, window_start, n_picks = PICKS.unpack_from(payload)
+    return source_id, window_start, np.frombuffer(payload, dtype=PICK_RECORD_DTYPE, count=n_picks,
+                                                  offset=PICKS.size)
+
+
+class ChannelRingBuffer:
+    """
+    The last capacity samples of every channel of a stream, addressed by the absolute sample index.
+    """
+    def __init__(self, n_channels, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self.buffer = np.zeros((n_channels, capacity), dtype=dtype)
+        self.end = 0  # number of samples written since the stream start
+        self._reset_at = 0
+
+    @property
+    def start(self):
+        """
+        The first sample still in the buffer.
+        """
+        return max(self.end - self.capacity, self._reset_at)
+
+    def reset(self, end):
+        """
+        Drop all the samples and continue the stream at sample end.
+        """
+        self.buffer[:] = 0
+        self.end = self._reset_at = end
+
+    def write(self, block):
+        n_samples = block.shape[1]
+        assert n_samples <= self.capacity, "The block is longer than the ring buffer"
+        position = self.end % self.capacity
+        first_part = min(n_samples, self.capacity - position)
+        self.buffer[:, position:position + first_part] = block[:, :first_part]
+        self.buffer[:, :n_samples - first_part] = block[:, first_part:]
+        self.end += n_samples
+
+    def read(self, start, length):
+        """
+        Copy of the samples [start, start + length) of every channel.
+        """
+        assert self.start <= start and start + length <= self.end, "The samples are not in the buffer"
+        positions = np.arange(start, start + length) % self.capacity
+        return self.buffer[:, positions]
+
+
+def window_picker(window, sampling_rate, pattern_method="sta_lta", min_score=0.5):
+    """
+    The gather engine on one window: the pilot pattern of the first channel (gather_signal_pattern_range) is
+    cross-correlated with every channel. Only the picks with a normalized correlation peak of at least
+    min_score are kept (a window without an arrival has low peaks).
+
+    Returns:
+        (channels, samples from the window start, scores) of the kept picks.
+    """
+    first_break_frame, end_break_frame = gather_signal_pattern_range(window, sampling_rate, pattern_method)
+    if end_break_frame <= first_break_frame:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    first_breaks, peaks = pick_gather(normalize_gather(window), first_break_frame, end_break_frame, sampling_rate,
+                                      return_peak=True)
+    channels = np.flatnonzero(peaks >= min_score)
+    return channels, np.round(first_breaks[channels] * sampling_rate).astype(np.int64), peaks[channels]
+
+
+class IngestServer:
+    """
+    asyncio server for the sources (HELLO, SAMPLES..., END) and the subscribers (SUBSCRIBE) of the protocol above.
+    :param window_size: samples per picked window, hop_size samples between the windows (window_size by default).
+    :param picker: function (window, sampling_rate) -> (channels, samples, scores), window_picker by default.
+                   It runs on one worker thread, so the windows are picked in order.
+    :param max_pending_windows: windows waiting for the picker before the sources are not read anymore.
+    :param subscriber_queue_size: unsent PICKS frames per subscriber before its oldest frames are dropped.
+    """
+    def __init__(self, window_size=1000, hop_size=None, picker=window_picker, max_pending_windows=4,
+                 subscriber_queue_size=64):
+        self.window_size = window_size
+        self.hop_size = hop_size or window_size
+        assert 0 < self.hop_size <= window_size, "hop_size must be in (0, window_size]"
+        self.picker = picker
+        self.subscriber_queue_size = subscriber_queue_size
+        self.stats = {'windows': 0, 'picks': 0, 'dropped_frames': 0, 'backpressure_waits': 0, 'max_latency_s': 0.0,
+                      'gap_samples': 0, 'skipped_windows': 0}
+        self._windows = asyncio.Queue(maxsize=max_pending_windows)
+        self._subscribers = set()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next_source_id = 0
+        self._connections = {}  # connection handler task -> its writer
+        self._server, self._worker = None, None
+
+    async def start(self, host="127.0.0.1", port=0, unix_path=None):
+        if unix_path:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=unix_path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+        self._worker = asyncio.create_task(self._picking_worker())
+        return self
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def drain(self):
+        """
+        Wait until all the received windows are picked and published.
+        """
+        await self._windows.join()
+
+    async def close(self):
+        self._server.close()
+        for writer in self._connections.values():
+            writer.close()  # the handlers end when their reader sees the end of the stream
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._worker.cancel()
+        self._executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            frame = await read_frame(reader)
+            if frame is None:
+                return
+            message_type, payload = frame
+            if message_type == MSG_HELLO:
+                try:
+                    n_channels, sampling_rate = HELLO.unpack(payload)
+                except struct.error as error:
+                    raise ConnectionError("Malformed hello payload") from error
+                await self._handle_source(reader, n_channels, sampling_rate)
+            elif message_type == MSG_SUBSCRIBE:
+                await self._handle_subscriber(reader, writer)
+            else:
+                raise ConnectionError(f"Unexpected first message {message_type}")
+        except (ConnectionError, asyncio.IncompleteReadError) as error:
+            instrumentation.event('ingest_connection_error', error=repr(error))
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    async def _handle_source(self, reader, n_channels, sampling_rate):
+        source_id, self._next_source_id = self._next_source_id, self._next_source_id + 1
+        ring, window_start = None, 0
+        instrumentation.event('ingest_source', source=source_id, n_channels=n_channels, sampling_rate=sampling_rate)
+
+        while (frame := await read_frame(reader)) is not None:
+            message_type, payload = frame
+            if message_type == MSG_END:
+                break
+            if message_type != MSG_SAMPLES:
+                raise ConnectionError(f"Unexpected source message {message_type}")
+            first_sample, block = decode_samples(payload, n_channels)
+            if ring is None:
+                ring = ChannelRingBuffer(n_channels, capacity=2 * self.window_size + block.shape[1])
+            block = block[:, max(ring.end - first_sample, 0):]  # repeated samples are skipped
+            if block.shape[1] > ring.capacity:
+                raise ConnectionError("The samples packet is longer than the ring buffer")
+            gap = first_sample - ring.end
+            if gap > 0:
+                # lost packets: a gap that fits in the ring buffer is filled with zeros, a longer one restarts it
+                instrumentation.count('ingest_gap_samples', gap)
+                self.stats['gap_samples'] += gap
+                if gap >= ring.capacity:
+                    ring.reset(first_sample)
+                else:
+                    ring.write(np.zeros((n_channels, gap), dtype=np.float32))
+                window_start = self._skip_lost_windows(ring, window_start)
+            ring.write(block)
+            window_start = self._skip_lost_windows(ring, window_start)
+
+            while window_start + self.window_size <= ring.end:
+                window = (source_id, sampling_rate, window_start, ring.read(window_start, self.window_size),
+                          time.perf_counter())
+                if self._windows.full():
+                    self.stats['backpressure_waits'] += 1
+                await self._windows.put(window)  # blocks the reading of this source while the picker is behind
+                window_start += self.hop_size
+
+    def _skip_lost_windows(self, ring, window_start):
+        """
+        Move the next window start past the samples that are not in the ring buffer anymore.
+        """
+        if window_start >= ring.start:
+            return window_start
+        skipped_windows = -(-(ring.start - window_start) // self.hop_size)
+        self.stats['skipped_windows'] += skipped_windows
+        instrumentation.count('ingest_skipped_windows', skipped_windows)
+        return ring.start
+
+    async def _handle_subscriber(self, reader, writer):
+        frames = asyncio.Queue(maxsize=self.subscriber_queue_size)
+        self._subscribers.add(frames)
+
+        async def send_frames():
+            while True:
+                writer.write(await frames.get())
+                await writer.drain()
+
+        sender = asyncio.create_task(send_frames())
+        try:
+            await reader.read()  # until the subscriber disconnects
+        finally:
+            self._subscribers.discard(frames)
+            sender.cancel()
+
+    async def _picking_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            source_id, sampling_rate, window_start, window, received_time = await self._windows.get()
+            try:
+                channels, samples, scores = await loop.run_in_executor(self._executor, self.picker, window,
+                                                                       sampling_rate)
+                # with overlapping windows only the picks in the new part of the window are published
+                new_from = self.window_size - self.hop_size if window_start > 0 else 0
+                keep = samples >= new_from
+                picks = np.empty(np.count_nonzero(keep), dtype=PICK_RECORD_DTYPE)
+                picks['channel'], picks['sample'], picks['score'] = (channels[keep], window_start + samples[keep],
+                                                                     scores[keep])
+                self._publish(encode_picks(source_id, window_start, picks))
+
+                latency = time.perf_counter() - received_time
+                self.stats['windows'] += 1
+                self.stats['picks'] += len(picks)
+                self.stats['max_latency_s'] = max(self.stats['max_latency_s'], latency)
+                instrumentation.event('ingest_window', source=source_id, window_start=window_start, picks=len(picks),
+                                      latency_s=latency)
+            except Exception as error:
+                instrumentation.event('ingest_picking_error', source=source_id, window_start=window_start,
+                                      error=repr(error))
+            finally:
+                self._windows.task_done()
+
+    def _publish(self, frame):
+        for frames in self._subscribers:
+            if frames.full():
+                frames.get_nowait()
+                self.stats['dropped_frames'] += 1
+            frames.put_nowait(frame)
+
+
+async def _open_connection(host="127.0.0.1", port=None, unix_path=None):
+    if unix_path:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def replay_mat_file(data_file_path=DATA_FILES[1], host="127.0.0.1", port=None, unix_path=None,
+                          packet_size=100, speed=1.0, repeat=1):
+    """
+    Simulator source: send the gather of a .mat file as SAMPLES packets of packet_size samples.
+    speed 1 is real time, 10 is ten times faster and 0 is as fast as the server reads (only the backpressure).
+    repeat replays the file again after its end, as one continuous stream.
+
+    Returns:
+        The number of samples sent per channel.
+    """
+    sensors_data_dict = load_mat_file(mat_path_file=data_file_path)
+    sensors_data = np.tile(np.asarray(sensors_data_dict['data'], dtype=np.float32), (1, repeat))
+    sampling_rate = float(sensors_data_dict['fs'][0][0])
+    reader, writer = await _open_connection(host, port, unix_path)
+    try:
+        writer.write(encode_frame(MSG_HELLO, HELLO.pack(len(sensors_data), sampling_rate)))
+        start_time = time.perf_counter()
+        for first_sample in range(0, sensors_data.shape[1], packet_size):
+            writer.write(encode_samples(first_sample, sensors_data[:, first_sample:first_sample + packet_size]))
+            await writer.drain()
+            if speed:
+                delay = start_time + (first_sample + packet_size) / sampling_rate / speed - time.perf_counter()
+                await asyncio.sleep(max(delay, 0))
+        writer.write(encode_frame(MSG_END))
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return sensors_data.shape[1]
+
+
+async def subscribe(host="127.0.0.1", port=None, unix_path=None):
+    """
+    Async generator of the published picks: (source id, window start, PICK_RECORD_DTYPE records).
+    """
+    reader, writer = await _open_connection(host, port, unix_path)
+    try:
+        writer.write(encode_frame(MSG_SUBSCRIBE))
+        await writer.drain()
+        while (frame := await read_frame(reader)) is not None:
+            message_type, payload = frame
+            if message_type == MSG_PICKS:
+                yield decode_picks(payload)
+    finally:
+        writer.close()
+
+
+async def _serve(args):
+    server = await IngestServer(window_size=args.window, hop_size=args.hop,
+                                max_pending_windows=args.max_pending_windows).start(args.host, args.port, args.unix)
+    print(f"Listening on {server.address}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+async def _print_picks(args):
+    async for source_id, window_start, picks in subscribe(args.host, args.port, args.unix):
+        for pick in picks:
+            print(f"source={source_id} window={window_start} channel={pick['channel']} sample={pick['sample']} "
+                  f"score={pick['score']:.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live ingest server and clients for first break picking")
+    parser.add_argument("command", choices=["serve", "replay", "subscribe"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--unix", help="Unix socket path instead of TCP")
+    parser.add_argument("--window", type=int, default=1000, help="samples per picked window (serve)")
+    parser.add_argument("--hop", type=int, default=None, help="samples between the windows (serve)")
+    parser.add_argument("--max-pending-windows", type=int, default=4, help="(serve)")
+    parser.add_argument("--file", default=DATA_FILES[1], help=".mat file to replay (replay)")
+    parser.add_argument("--packet-size", type=int, default=100, help="(replay)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 is real time, 0 as fast as possible (replay)")
+    parser.add_argument("--repeat", type=int, default=1, help="(replay)")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_from_arguments(args)
+
+    try:
+        with maybe_instrumented_run():
+            if args.command == "serve":
+                asyncio.run(_serve(args))
+            elif args.command == "replay":
+                n_samples = asyncio.run(replay_mat_file(args.file, args.host, args.port, args.unix,
+                                                        args.packet_size, args.speed, args.repeat))
+                print(f"Sent {n_samples} samples per channel")
+            else:
+                asyncio.run(_print_picks(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
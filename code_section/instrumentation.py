@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import pstats
+import logging
+import cProfile
+import tracemalloc
+import contextlib
+from io import StringIO
+from collections import defaultdict
+
+STAGES = ["normalization", "noise", "sta_lta", "aic", "correlation", "plotting"]
+
+# Comma separated sink spec (a JSON lines file path or "log") and profile / trace_memory flags, read at import,
+# e.g. PICKING_INSTRUMENT=run.jsonl,profile,trace_memory
+INSTRUMENT_ENV_VAR = "PICKING_INSTRUMENT"
+
+
+class NullSink:
+    """
+    The default sink, nothing is recorded and the instrumentation calls return right away.
+    """
+    enabled = False
+
+    def emit(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class LoggerSink:
+    """
+    Sink that writes every record to a logger.
+    """
+    enabled = True
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("code_section")
+        self.level = level
+
+    def emit(self, record):
+        self.logger.log(self.level, "%s", " ".join(f"{key}={value}" for key, value in record.items()))
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+    Sink that appends every record as one JSON line to a file.
+    """
+    enabled = True
+
+    def __init__(self, file_path):
+        # line buffered, every record is one append, so processes can share the file
+        self._file = open(file_path, "a", buffering=1)
+
+    def emit(self, record):
+        self._file.write(json.dumps(record, default=float) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, instrumentation, name, fields):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        self.instrumentation.timers[self.name] += duration
+        self.instrumentation.counters[self.name] += 1
+        self.instrumentation.sink.emit({'type': 'stage', 'stage': self.name, 'duration_s': duration, **self.fields})
+        return False
+
+
+class Instrumentation:
+    """
+    Per stage timers and counters of the pipeline, the records go to the sink.
+    With the default NullSink the stages are a shared no-op context, so quiet runs don't pay for the timing.
+    """
+    def __init__(self, sink=None):
+        self.sink = sink or NullSink()
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @property
+    def enabled(self):
+        return self.sink.enabled
+
+    def stage(self, name, **fields):
+        """
+        Context manager that times the stage (one of STAGES or any other name).
+        """
+        if not self.sink.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, fields)
+
+    def count(self, name, value=1):
+        if self.sink.enabled:
+            self.counters[name] += value
+
+    def event(self, name, **fields):
+        """
+        Structured record of a pipeline result (instead of print).
+        """
+        if self.sink.enabled:
+            self.sink.emit({'type': 'event', 'event': name, **fields})
+
+    def summary(self) -> dict:
+        return {'type': 'summary', 'timers_s': dict(self.timers), 'counters': dict(self.counters)}
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+
+
+_instrumentation = Instrumentation()
+# the instrumented_run defaults of configure
+_run_options = {'profile': False, 'trace_memory': False}
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def sink_from_spec(spec):
+    """
+    The sink of an instrumentation spec: "log" for a LoggerSink (its output is enabled), any other value is
+    the path of a JsonLinesSink, and an empty spec is the NullSink.
+    """
+    if not spec:
+        return NullSink()
+    if spec == "log":
+        logger = logging.getLogger("code_section")
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        return LoggerSink(logger)
+    return JsonLinesSink(spec)
+
+
+def parse_instrument_spec(value) -> dict:
+    """
+    The configure arguments of a PICKING_INSTRUMENT value: at most one sink spec ("log" by default) and the
+    profile and trace_memory flags, comma separated.
+    """
+    parts = [part.strip() for part in value.split(",") if part.strip()]
+    specs = [part for part in parts if part not in ("profile", "trace_memory")]
+    if len(specs) > 1:
+        raise ValueError(f"{INSTRUMENT_ENV_VAR} has more than one sink: {specs}")
+    return {'spec': specs[0] if specs else "log", 'profile': "profile" in parts,
+            'trace_memory': "trace_memory" in parts}
+
+
+def set_sink(sink=None) -> Instrumentation:
+    """
+    Replace the sink of the pipeline instrumentation (None for the NullSink).
+    """
+    _instrumentation.sink.close()
+    _instrumentation.sink = sink or NullSink()
+    _instrumentation.reset()
+    return _instrumentation
+
+
+def configure(spec=None, profile=False, trace_memory=False) -> Instrumentation:
+    """
+    Install the sink of the spec (see sink_from_spec) for the whole process and set the profile and
+    trace_memory defaults of instrumented_run.
+    Called at import with PICKING_INSTRUMENT, by the --instrument / --profile / --trace-memory flags of the
+    command line tools and in every batch worker.
+    """
+    _run_options.update(profile=profile, trace_memory=trace_memory)
+    return set_sink(sink_from_spec(spec))
+
+
+def add_instrumentation_arguments(parser):
+    """
+    The --instrument, --profile and --trace-memory flags of a command line tool (see configure_from_arguments).
+    """
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--instrument", metavar="PATH|log",
+                       help=f"JSON lines file or 'log' for the stage records (or set {INSTRUMENT_ENV_VAR})")
+    group.add_argument("--profile", action="store_true", help="add a cProfile record to every run summary")
+    group.add_argument("--trace-memory", action="store_true", help="add a tracemalloc peak memory record")
+    return group
+
+
+def configure_from_arguments(args):
+    """
+    configure with the instrumentation flags, when any is given (the PICKING_INSTRUMENT setup otherwise).
+
+    Returns:
+        The configure arguments, None without flags.
+    """
+    if not (args.instrument or args.profile or args.trace_memory):
+        return None
+    options = {'spec': args.instrument or "log", 'profile': args.profile, 'trace_memory': args.trace_memory}
+    configure(**options)
+    return options
+
+
+@contextlib.contextmanager
+def instrumented_run(sink=None, profile=None, trace_memory=None, profile_lines=30):
+    """
+    Instrument one run: the stages go to the sink (the configured sink, or a LoggerSink when there is none) and
+    at the end a summary record is emitted with the totals. profile adds a cProfile record with the top
+    profile_lines functions by cumulative time, trace_memory adds a tracemalloc record with the peak memory
+    (both default to the configure options).
+    """
+    previous_sink = _instrumentation.sink
+    profile = _run_options['profile'] if profile is None else profile
+    trace_memory = _run_options['trace_memory'] if trace_memory is None else trace_memory
+    _instrumentation.sink = sink or (previous_sink if previous_sink.enabled else LoggerSink())
+    _instrumentation.reset()
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield _instrumentation
+    finally:
+        if profiler:
+            profiler.disable()
+            profile_text = StringIO()
+            pstats.Stats(profiler, stream=profile_text).sort_stats("cumulative").print_stats(profile_lines)
+            _instrumentation.sink.emit({'type': 'profile', 'stats': profile_text.getvalue()})
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _instrumentation.sink.emit({'type': 'memory', 'current_mb': current / 1024 ** 2,
+                                        'peak_mb': peak / 1024 ** 2})
+        _instrumentation.sink.emit(_instrumentation.summary())
+        if _instrumentation.sink is not previous_sink:
+            _instrumentation.sink.close()
+        _instrumentation.sink = previous_sink
+
+
+def maybe_instrumented_run():
+    """
+    instrumented_run when a sink is configured, a no-op context otherwise (the command line tools run in it).
+    """
+    return instrumented_run() if _instrumentation.enabled else contextlib.nullcontext()
+
+
+if os.environ.get(INSTRUMENT_ENV_VAR):
+    configure(**parse_instrument_spec(os.environ[INSTRUMENT_ENV_VAR]))
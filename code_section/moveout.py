@@ -0,0 +1,90 @@
+import numpy as np
+
+MOVEOUT_MODELS = ["linear", "hyperbolic"]
+
+
+def spread_offsets(geometry):
+    """
+    Signed distance of each sensor from the first sensor along the spread: the principal direction of the
+    sensor positions, pointing to the last sensor (or to the farthest one when the last sensor is at the first
+    sensor position). All zeros when all the sensors are at the same position.
+    """
+    geometry = np.asarray(geometry, dtype=float)
+    relative = geometry - geometry[0]
+    _, singular_values, directions = np.linalg.svd(geometry - geometry.mean(axis=0), full_matrices=False)
+    if len(singular_values) == 0 or singular_values[0] == 0:
+        return np.zeros(len(relative))
+    offsets = relative @ directions[0]
+    reference = offsets[-1] if offsets[-1] != 0 else offsets[np.argmax(np.abs(offsets))]
+    return -offsets if reference < 0 else offsets
+
+
+def fit_moveout(offsets, arrivals, model="linear", weights=None, max_residual=None, n_candidates=100,
+                return_inliers=False):
+    """
+    Weighted least squares fit of the first arrivals (samples) as a function of the offsets.
+    'linear': t = a + b*x, a shot at one end of the spread.
+    'hyperbolic': t^2 = a + b*x + c*x^2, a point source anywhere along the spread (its apex does not have to be
+    at the first sensor).
+    :param max_residual: when given, the model is fitted only on the arrivals within max_residual samples of the
+                         best of n_candidates models through minimal subsets of the arrivals (RANSAC), so
+                         mispicks don't pull the model away from the other arrivals.
+    :param return_inliers: return also the boolean mask of the arrivals the model was fitted on.
+
+    Returns:
+        The polynomial coefficients (highest power first) for predict_moveout.
+    Raises:
+        ValueError when the offsets can't determine the model (less than degree + 1 different offsets, or no
+        candidate subset of different offsets).
+    """
+    offsets, arrivals = np.asarray(offsets, dtype=float), np.asarray(arrivals, dtype=float)
+    weights = np.ones(len(offsets)) if weights is None else np.asarray(weights, dtype=float)
+    if model == "linear":
+        degree, values = 1, arrivals
+    elif model == "hyperbolic":
+        degree, values = 2, arrivals ** 2
+    else:
+        raise ValueError(f"model must be one of {MOVEOUT_MODELS}")
+    if len(np.unique(offsets)) <= degree:
+        raise ValueError(f"The {model} moveout needs at least {degree + 1} different offsets")
+
+    inliers = np.ones(len(offsets), dtype=bool)
+    if max_residual is not None:
+        # the candidates are solved together as (n_candidates, degree + 1) Vandermonde systems
+        rng = np.random.default_rng(0)
+        subsets = np.argsort(rng.random((n_candidates, len(offsets))), axis=1)[:, :degree + 1]
+        subsets = subsets[np.all(np.diff(np.sort(offsets[subsets], axis=1), axis=1) > 0, axis=1)]
+        if len(subsets) == 0:
+            raise ValueError(f"No candidate subset of {degree + 1} different offsets for the {model} moveout")
+        powers = np.arange(degree, -1, -1)
+        candidates = np.linalg.solve(offsets[subsets][..., None] ** powers, values[subsets][..., None])[..., 0]
+        predicted_values = candidates @ (offsets[:, None] ** powers).T
+        if model == "hyperbolic":
+            predicted_values = np.sqrt(np.maximum(predicted_values, 0))
+        candidates_inliers = np.abs(predicted_values - arrivals) <= max_residual
+        inliers = candidates_inliers[np.argmax(candidates_inliers @ weights)]
+    coefficients = np.polyfit(offsets[inliers], values[inliers], degree, w=weights[inliers])
+    if return_inliers:
+        return coefficients, inliers
+    return coefficients
+
+
+def predict_moveout(coefficients, offsets, model="linear"):
+    """
+    The first arrival (samples) of each offset by the fit_moveout coefficients.
+    """
+    values = np.polyval(coefficients, np.asarray(offsets, dtype=float))
+    if model == "hyperbolic":
+        return np.sqrt(np.maximum(values, 0))
+    return values
+
+
+def moveout_windows(predicted_arrivals, half_width, n_positions):
+    """
+    Search windows [start, end) of 2 * half_width + 1 positions centered on the predicted arrivals.
+    The windows near the trace edges are shifted (not shortened) to stay inside [0, n_positions), so all of
+    them have the same length and can be processed as one array.
+    """
+    width = min(2 * int(half_width) + 1, n_positions)
+    starts = np.clip(np.round(predicted_arrivals).astype(np.int64) - int(half_width), 0, n_positions - width)
+    return np.stack([starts, starts + width], axis=-1)
@@ -0,0 +1,97 @@
+import numpy as np
+from functools import lru_cache
+from scipy import fft as sp_fft
+
+# Spectral exponent of each noise color, the noise power spectrum is proportional to 1/f^exponent
+NOISE_COLORS = {'white': 0.0, 'pink': 1.0, 'brown': 2.0, 'blue': -1.0, 'violet': -2.0}
+
+
+def color_exponent(noise_type) -> float:
+    """
+    The spectral exponent of a noise color name (see NOISE_COLORS) or of a number.
+    """
+    if isinstance(noise_type, str):
+        if noise_type.lower() not in NOISE_COLORS:
+            raise ValueError(f"noise_type must be one of {list(NOISE_COLORS)} or a spectral exponent")
+        return NOISE_COLORS[noise_type.lower()]
+    return float(noise_type)
+
+
+@lru_cache(maxsize=64)
+def shaping_filter(n_samples, fs, exponent, dtype=np.float64):
+    """
+    The (cached, read-only) rfft amplitude gain f^(-exponent/2) of a trace of n_samples samples,
+    the DC bin is left as is.
+    """
+    freqs = sp_fft.rfftfreq(n_samples, 1 / fs)
+    gain = np.ones(len(freqs), dtype=dtype)
+    gain[1:] = freqs[1:] ** (-exponent / 2)
+    gain.setflags(write=False)
+    return gain
+
+
+def generate_noise(shape, fs=2000, noise_type="white", rng=None, dtype=np.float64, scale=1.0, out=None):
+    """
+    Noise of the given shape, all the traces (last axis) are generated in one batch.
+    White noise is N(0, scale^2). Colored noise (pink, brown, ... or a spectral exponent) is white noise shaped
+    by the cached shaping_filter in one batched rfft / irfft, and normalized to std scale per trace.
+    :param rng: np.random.Generator for reproducible noise, the global np.random state is used by default.
+    :param dtype: np.float64 or np.float32 (generated and transformed in single precision with a Generator).
+    :param scale: noise std, a number or an array that broadcasts with shape[:-1] + (1,).
+    :param out: preallocated array of the shape to write the noise to (its dtype is used), so a workspace can be
+                reused for every call.
+    """
+    rng = np.random if rng is None else rng
+    dtype = np.dtype(dtype if out is None else out.dtype)
+    if out is not None and isinstance(rng, np.random.Generator) and out.flags.c_contiguous:
+        noise = rng.standard_normal(out=out, dtype=dtype)
+    elif isinstance(rng, np.random.Generator):
+        noise = rng.standard_normal(shape, dtype=dtype)
+    else:
+        noise = rng.standard_normal(shape).astype(dtype, copy=False)
+
+    exponent = color_exponent(noise_type)
+    if exponent != 0:
+        n_samples = shape[-1]
+        spectrum = sp_fft.rfft(noise, axis=-1)
+        spectrum *= shaping_filter(n_samples, fs, exponent, dtype)
+        noise = sp_fft.irfft(spectrum, n=n_samples, axis=-1)
+        noise /= np.std(noise, axis=-1, keepdims=True)
+    noise *= np.asarray(scale, dtype=dtype)
+    if out is not None and noise is not out:
+        out[...] = noise
+        return out
+    return noise
+
+
+def add_noise(full_data, snr_db=2, noise_type="white", fs=2000, rng=None, dtype=None, trials=None, out=None,
+              workspace=None):
+    """
+    Add noise (white, pink or any other color) to a signal according to a given SNR, the SNR is kept per trace.
+    :param full_data: array (..., n_samples).
+    :param rng: np.random.Generator for reproducible noise, the global np.random state is used by default.
+    :param dtype: output dtype (np.float32 halves the memory), by default float64 (or the out dtype).
+    :param trials: when given, trials noise realizations of full_data are returned as one
+                   (trials, ...) block, the signal power is computed once.
+    :param out: array to write the result to. The noise is generated straight into out and the data is added to
+                it, out=full_data adds the noise in place.
+    :param workspace: optional Workspace (code_section.workspace) for the noise buffer of the in-place case.
+    """
+    data = np.asarray(full_data)
+    dtype = np.dtype(out.dtype if out is not None else np.float64 if dtype is None else dtype)
+    snr_linear = 10 ** (snr_db / 10)
+    noise_std = np.sqrt(np.mean(data ** 2, axis=-1, keepdims=True) / snr_linear)
+    shape = data.shape if trials is None else (trials,) + data.shape
+
+    if out is None:
+        noise = generate_noise(shape, fs=fs, noise_type=noise_type, rng=rng, dtype=dtype, scale=noise_std)
+        noise += data
+        return noise
+    if np.may_share_memory(out, data):
+        noise_buffer = None if workspace is None else workspace.get('noise', shape, dtype)
+        noise = generate_noise(shape, fs=fs, noise_type=noise_type, rng=rng, dtype=dtype, scale=noise_std,
+                               out=noise_buffer)
+        return np.add(data, noise, out=out)
+    generate_noise(shape, fs=fs, noise_type=noise_type, rng=rng, scale=noise_std, out=out)
+    out += data
+    return out
@@ -0,0 +1,132 @@
+import numpy as np
+
+from code_section.consts import STA_LTA_PARAMS
+from code_section.noise import add_noise
+from code_section.correlation import PilotCorrelator
+from code_section.utils.utils import load_mat_file, normalize_gather, sta_lta_gather, find_break_ranges
+from code_section.algorithms import refine_signal_pattern_range, aic_signal_pattern_range
+
+DEFAULT_PARAMS = {'data_file_path': None, 'noise_type': "", 'snr_db': 2, 'seed': None,
+                  'pattern_method': "sta_lta", 'max_time': 0.1, **STA_LTA_PARAMS}
+
+
+def _load(data_file_path):
+    sensors_data_dict = load_mat_file(mat_path_file=data_file_path)
+    return {'data': sensors_data_dict['data'], 'fs': sensors_data_dict['fs'][0][0],
+            'geometry': sensors_data_dict.get('geometry')}
+
+
+def _normalize(load):
+    return normalize_gather(load['data'])
+
+
+def _sta_lta(normalize, sta_group_size, lta_group_size):
+    return sta_lta_gather(normalize, sta_group_size, lta_group_size)
+
+
+def _trigger(load, sta_lta, threshold, max_time):
+    first_break_frames, end_break_frames = find_break_ranges(sta_lta, threshold, max_gap=int(max_time * load['fs']))
+    return np.stack([first_break_frames, end_break_frames], axis=-1)
+
+
+def _pilot(load, normalize, trigger, pattern_method):
+    if pattern_method == "sta_lta":
+        return refine_signal_pattern_range(normalize[0], *trigger[0])
+    if pattern_method == "aic":
+        return aic_signal_pattern_range(load['data'][0])
+    raise ValueError("pattern_method must be 'sta_lta' or 'aic'")
+
+
+def _noise(load, normalize, noise_type, snr_db, seed):
+    if not noise_type:
+        return normalize
+    rng = None if seed is None else np.random.default_rng(seed)
+    return add_noise(normalize, snr_db=snr_db, noise_type=noise_type, fs=load['fs'], rng=rng)
+
+
+def _correlate(noise, pilot):
+    first_break_frame, end_break_frame = pilot
+    # as in the per-sensor algorithms, the pattern is sliced from the (noised) first sensor data
+    return PilotCorrelator(noise[0, first_break_frame:end_break_frame]).pick(noise, return_peak=True)
+
+
+def _pick(load, correlate):
+    lags, _ = correlate
+    return lags / load['fs']
+
+
+def _same_result(old_result, new_result):
+    if isinstance(old_result, dict) or isinstance(new_result, dict):
+        return False
+    try:
+        return np.array_equal(old_result, new_result)
+    except (TypeError, ValueError):
+        return False
+
+
+class IncrementalPipeline:
+    """
+    The picking pipeline as a small dependency graph:
+        load -> normalize -> sta_lta -> trigger -> pilot -> correlate -> pick
+                          \\-> noise ------------------------/
+    Each stage keeps its result with the parameters and upstream versions it was computed from, and is
+    computed again only when one of them changed, and a stage that gives the same result as before doesn't
+    invalidate the stages after it. For example, a new threshold re-runs trigger and the
+    stages after it on the cached STA/LTA ratios, and a new SNR re-runs noise, correlate and pick only.
+    With seed=None the noise uses the global np.random state and is drawn again only when its parameters change.
+    """
+    def __init__(self, **params):
+        self.params = dict(DEFAULT_PARAMS)
+        self.stages = {}
+        self.recomputed = []
+        self._results, self._signatures, self._versions = {}, {}, {}
+
+        self.add_stage('load', _load, params=('data_file_path',))
+        self.add_stage('normalize', _normalize, upstream=('load',))
+        self.add_stage('sta_lta', _sta_lta, params=('sta_group_size', 'lta_group_size'), upstream=('normalize',))
+        self.add_stage('trigger', _trigger, params=('threshold', 'max_time'), upstream=('load', 'sta_lta'))
+        self.add_stage('pilot', _pilot, params=('pattern_method',), upstream=('load', 'normalize', 'trigger'))
+        self.add_stage('noise', _noise, params=('noise_type', 'snr_db', 'seed'), upstream=('load', 'normalize'))
+        self.add_stage('correlate', _correlate, upstream=('noise', 'pilot'))
+        self.add_stage('pick', _pick, upstream=('load', 'correlate'))
+        self.set_params(**params)
+
+    def add_stage(self, name, function, params=(), upstream=()):
+        """
+        Add (or replace) a stage, function is called with the upstream results (by position) and the
+        params (by name).
+        """
+        self.stages[name] = (function, tuple(params), tuple(upstream))
+        self._signatures.pop(name, None)
+
+    def set_params(self, **params):
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise KeyError(f"Unknown pipeline parameters: {sorted(unknown)}")
+        self.params.update(params)
+
+    def get(self, name):
+        """
+        The stage result, computing it and the upstream stages only when their inputs changed.
+        """
+        function, params, upstream = self.stages[name]
+        upstream_results = [self.get(upstream_name) for upstream_name in upstream]
+        signature = (tuple(self.params[param] for param in params),
+                     tuple(self._versions[upstream_name] for upstream_name in upstream))
+        if self._signatures.get(name) != signature:
+            result = function(*upstream_results, **{param: self.params[param] for param in params})
+            self._signatures[name] = signature
+            self.recomputed.append(name)
+            # early cutoff: an unchanged result (e.g. the same pilot range) doesn't invalidate the next stages
+            if name not in self._results or not _same_result(self._results[name], result):
+                self._results[name] = result
+                self._versions[name] = self._versions.get(name, 0) + 1
+        return self._results[name]
+
+    def run(self, stage='pick', **params):
+        """
+        Update the parameters and return the stage result, self.recomputed lists the stages that were computed.
+        """
+        self.set_params(**params)
+        self.recomputed = []
+        return self.get(stage)
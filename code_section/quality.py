@@ -0,0 +1,74 @@
+import numpy as np
+
+# Quality of one pick, the metrics of a tier that did not run are nan
+PICK_QUALITY_DTYPE = np.dtype([('tier', np.int8),               # 0 - STA/LTA + AIC, 1 - pilot correlation
+                               ('score', np.float32),           # the metric of the tier in [0, 1], for filtering
+                               ('sta_lta_margin', np.float32),
+                               ('aic_sharpness', np.float32),
+                               ('onset_power_ratio', np.float32),
+                               ('correlation_peak', np.float32),
+                               ('peak_ratio', np.float32)])
+
+
+def sta_lta_margin(ratio, first_break_frames, end_break_frames, threshold=1.75, edge=0):
+    """
+    The maximum STA/LTA ratio of each trace inside its break range, relative to the trigger threshold
+    (below 1 when the trace never triggered).
+    The zero padding of the centered STA/LTA inflates the ratio within edge samples of the trace ends (half the
+    LTA group), so those samples are not taken, and a break range that starts in the last edge samples or is
+    clamped at the last sample has margin 0.
+    """
+    n_samples = ratio.shape[-1]
+    positions = np.arange(n_samples)
+    in_range = (positions >= first_break_frames[:, None]) & (positions <= end_break_frames[:, None]) & \
+        (positions >= edge) & (positions < n_samples - edge)
+    margin = np.max(np.where(in_range, ratio, 0), axis=-1) / threshold
+    return np.where((first_break_frames >= n_samples - edge) | (end_break_frames >= n_samples - 1), 0, margin)
+
+
+def onset_power_ratio(traces, picks, window):
+    """
+    The mean power of each trace in the window samples from its pick over the mean power in the window samples
+    before it (inf when there is no power before the pick).
+    A first break follows quiet (noise) samples, a pick on the coda of an earlier arrival has a ratio about 1.
+    """
+    n_samples = traces.shape[-1]
+    energy = np.zeros((len(traces), n_samples + 1))
+    np.cumsum(np.square(traces, dtype=np.float64), axis=-1, out=energy[:, 1:])
+    rows = np.arange(len(traces))
+    start, end = np.maximum(picks - window, 0), np.minimum(picks + window, n_samples)
+    before = (energy[rows, picks] - energy[rows, start]) / np.maximum(picks - start, 1)
+    after = (energy[rows, end] - energy[rows, picks]) / np.maximum(end - picks, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(before > 0, after / before, np.inf)
+
+
+def aic_sharpness(aic_curves, minimum_index, half_width=20):
+    """
+    How deep the AIC minimum of each trace is in its neighborhood: the mean of the curve half_width samples
+    before and after the minimum, minus the minimum, relative to the curve range.
+    In [0, 1], about 0 for a flat curve or a minimum at the window edge and close to 1 for a sharp notch.
+    :param aic_curves: the aic_pick_batch curves (inf outside the trace window).
+    :param minimum_index: the index of each minimum in its curve (pick - window start - 1).
+    """
+    finite = np.isfinite(aic_curves)
+    last_index = np.sum(finite, axis=-1) - 1
+    rows = np.arange(len(aic_curves))
+    minimum = aic_curves[rows, minimum_index]
+    maximum = np.max(np.where(finite, aic_curves, -np.inf), axis=-1)
+    before = aic_curves[rows, np.maximum(minimum_index - half_width, 0)]
+    after = aic_curves[rows, np.minimum(minimum_index + half_width, last_index)]
+    return np.clip(((before + after) / 2 - minimum) / (maximum - minimum + 1e-12), 0, 1)
+
+
+def peak_ratio(correlation_result, lags, exclusion):
+    """
+    Peak-to-second-peak ratio of each correlation: the peak over the largest value farther than exclusion lags
+    from it (inf when there is no other positive value). Close to 1 means an ambiguous (cycle-skip prone) pick.
+    """
+    positions = np.arange(correlation_result.shape[-1])
+    outside = np.abs(positions - lags[..., None]) > exclusion
+    second_peak = np.max(np.where(outside, correlation_result, -np.inf), axis=-1)
+    peak = np.take_along_axis(correlation_result, lags[..., None], axis=-1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(second_peak > 0, peak / second_peak, np.inf)
@@ -1,22 +1,47 @@
 import numpy as np
 from typing import Any
-from scipy.signal import correlate, stft
 from numpy import ndarray, dtype, float64
 
+from code_section.noise import add_noise
+
 
 class SensorObj:
     """
     Class for sensor representing.
     This class have the all methods and attributes for find and analyze the sensors data.
     """
-    def __init__(self, data, sampling_rate, geometry_location=[0, 0, 0]):
-        self.data = (data - np.mean(data)) / np.std(data)
+    def __init__(self, data, sampling_rate, geometry_location=[0, 0, 0], dtype=None, copy=True):
+        """
+        :param dtype: dtype of the normalized data (np.float32 halves the memory), by default as numpy computes it.
+        :param copy: False normalizes a float data array in place and keeps it as the sensor data (no copy).
+        """
+        if copy and dtype is None:
+            self.data = (data - np.mean(data)) / np.std(data)
+        else:
+            self.data = np.array(data, dtype=dtype, copy=copy or None)
+            assert np.issubdtype(self.data.dtype, np.floating), "In place normalization needs float data"
+            mean, std = np.mean(self.data), np.std(self.data)
+            self.data -= mean
+            self.data /= std
         self.sampling_rate = sampling_rate
-        self.time = np.arange(len(data)) / sampling_rate
+        self._time = None
         self.geometry_location = geometry_location
         self.first_break_time = -1
         self.noise_type = None
 
+    @property
+    def time(self):
+        """
+        The samples time, computed on first use.
+        """
+        if getattr(self, '_time', None) is None:
+            self._time = np.arange(len(self.data)) / self.sampling_rate
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        self._time = value
+
     def _calculate_sta_lta(self, sta_group_size, lta_group_size) -> ndarray[tuple[Any, ...], dtype[float64]]:
         """
         Calculate STA/LTA according to the groups dividing the user enter.
@@ -75,36 +100,17 @@ class SensorObj:
         returning only the valid alignments (len(y) - len(x) + 1 values).
         """
         assert len(self.data) >= len(signal_pattern), "The full data must be the longer then the signal"
+        from scipy.signal import correlate  # scipy.signal is slow to import, only on first use
         return correlate(self.data, signal_pattern, mode='valid')
 
-    def add_noise(self, snr_db=2, noise_type="white") -> np.ndarray:
+    def add_noise(self, snr_db=2, noise_type="white", rng=None) -> np.ndarray:
         """
-        Add noise (white or pink) to a signal according to a given SNR.
+        Add noise (white, pink or another color of code_section.noise) to a signal according to a given SNR,
+        in place.
+        :param rng: np.random.Generator for reproducible noise, the global np.random state is used by default.
         """
         self.noise_type = noise_type
-
-        sig_power = np.mean(self.data ** 2)
-        # SNR: convert dB → linear
-        snr_linear = 10 ** (snr_db / 10)
-        noise_power = sig_power / snr_linear
-
-        if noise_type.lower() == "white":
-            noise = np.random.normal(0, np.sqrt(noise_power), len(self.data))
-
-        elif noise_type.lower() == "pink":
-            # Pink noise via frequency-domain shaping (1/sqrt(f))
-            white = np.random.normal(0, 1, len(self.data))
-            fft_vals = np.fft.rfft(white)
-            freqs = np.fft.rfftfreq(len(self.data), 1 / self.sampling_rate)
-            fft_vals /= np.where(freqs == 0, 1, np.sqrt(freqs))  # scale by 1/sqrt(f)
-            pink = np.fft.irfft(fft_vals, n=len(self.data))
-            pink = pink / np.std(pink) * np.sqrt(noise_power)  # scale to match power
-            noise = pink
-
-        else:
-            raise ValueError("noise_type must be 'white' or 'pink'")
-
-        self.data += noise
+        add_noise(self.data, snr_db=snr_db, noise_type=noise_type, fs=self.sampling_rate, rng=rng, out=self.data)
         return self.data
 
     def time_to_frequency_domain(self):
@@ -133,5 +139,6 @@ class SensorObj:
         time - STFT time bins.
         magnitude - STFT complex spectrogram.
         """
+        from scipy.signal import stft
         frequency, time, magnitude = stft(self.data, fs=self.sampling_rate, nperseg=nperseg, noverlap=noverlap, boundary=None)
         return frequency, time, magnitude
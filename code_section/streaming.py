@@ -0,0 +1,157 @@
+import numpy as np
+from typing import NamedTuple
+
+
+class TriggerEvent(NamedTuple):
+    channel: int
+    sample: int
+    kind: str  # 'onset' or 'offset'
+
+
+class StreamingStaLta:
+    """
+    Causal STA/LTA trigger for continuous multichannel data that arrive in blocks.
+    The class keeps running STA and LTA sums of each channel and a ring of its last lta_group_size absolute
+    samples, so every new sample only adds itself to the sums and subtracts the samples leaving the windows:
+    the memory and the work per sample are constant and do not depend on the record length or the block size.
+    The trigger semantics are the ones of SensorObj.find_break_range:
+        * onset - the first sample where ratio > threshold.
+        * offset - the first sample after the onset where ratio < threshold/2,
+          or onset + max_time (s) when the ratio stays high.
+    Comment: STA and LTA are trailing windows (not centered as in SensorObj._calculate_sta_lta),
+    so the ratio lags the offline ratio by about half a window. No onset is triggered before the first
+    LTA window is full.
+    """
+    # the running sums are computed again from the ring every resync_samples samples, so the rounding errors
+    # of the additions and subtractions don't accumulate over long streams
+    resync_samples = 1 << 16
+
+    def __init__(self, n_channels, sampling_rate, sta_group_size=30, lta_group_size=90, threshold=1.75, max_time=0.1):
+        assert lta_group_size >= sta_group_size, "The LTA group must be longer than the STA group"
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.sta_group_size = sta_group_size
+        self.lta_group_size = lta_group_size
+        self.threshold = threshold
+        self.max_gap = int(max_time * sampling_rate)
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the stream state, the ring starts with zeros as the zero padding of np.convolve.
+        """
+        self.samples_count = 0
+        self._ring = np.zeros((self.n_channels, self.lta_group_size))  # sample i is at i % lta_group_size
+        self._sta_sum = np.zeros(self.n_channels)
+        self._lta_sum = np.zeros(self.n_channels)
+        self._samples_since_resync = 0
+        self._triggered = np.zeros(self.n_channels, dtype=bool)
+        self._onset_sample = np.full(self.n_channels, -1, dtype=np.int64)
+
+    def _ring_samples(self, first_sample, n_samples):
+        """
+        The ring samples [first_sample, first_sample + n_samples) of every channel (samples before the stream
+        start are zeros).
+        """
+        return self._ring[:, np.arange(first_sample, first_sample + n_samples) % self.lta_group_size]
+
+    def _calculate_sta_lta(self, block):
+        """
+        Calculate the trailing STA/LTA of the block by updating the running sums sample by sample:
+        sum[t] = sum[t - 1] + |x[t]| - |x[t - group size]|, for all the channels and samples at once.
+        :return: STA/LTA (n_channels, block length).
+        """
+        abs_block = np.abs(block)
+        block_length, start = block.shape[1], self.samples_count
+
+        def leaving_samples(group_size):
+            # the samples group_size before each block sample, the first ones are still in the ring
+            from_ring = min(block_length, group_size)
+            return np.concatenate([self._ring_samples(start - group_size, from_ring),
+                                   abs_block[:, :block_length - from_ring]], axis=1)
+
+        sta_sums = self._sta_sum[:, None] + np.cumsum(abs_block - leaving_samples(self.sta_group_size), axis=1)
+        lta_sums = self._lta_sum[:, None] + np.cumsum(abs_block - leaving_samples(self.lta_group_size), axis=1)
+        self._sta_sum, self._lta_sum = sta_sums[:, -1], lta_sums[:, -1]
+
+        kept = min(block_length, self.lta_group_size)
+        self._ring[:, np.arange(start + block_length - kept, start + block_length) % self.lta_group_size] = \
+            abs_block[:, block_length - kept:]
+        self._samples_since_resync += block_length
+        if self._samples_since_resync >= self.resync_samples:
+            end = start + block_length
+            self._sta_sum = self._ring_samples(end - self.sta_group_size, self.sta_group_size).sum(axis=1)
+            self._lta_sum = self._ring.sum(axis=1)
+            self._samples_since_resync = 0
+
+        sta = np.maximum(sta_sums, 0) / self.sta_group_size
+        lta = np.maximum(lta_sums, 0) / self.lta_group_size + 1e-12
+        return sta / lta
+
+    @staticmethod
+    def _next_index(mask):
+        """
+        For every position of each row (and one position past the end), the first position at or after it where
+        mask is True (the row length when there is none).
+        """
+        n_positions = mask.shape[1]
+        positions = np.where(mask, np.arange(n_positions), n_positions)
+        next_index = np.minimum.accumulate(positions[:, ::-1], axis=1)[:, ::-1]
+        return np.concatenate([next_index, np.full((len(mask), 1), n_positions)], axis=1)
+
+    def _find_events(self, ratio):
+        """
+        Run the trigger state machine of all the channels over the block ratio.
+        The next onset / offset candidate of every position is found with array operations, so each round of the
+        state machine finds the next event of all the channels at once and only the events are visited.
+        :return: (channels, samples, kinds (0 onset, 1 offset)) arrays in the order of the events.
+        """
+        block_length, block_start = ratio.shape[1], self.samples_count
+        next_above = self._next_index(ratio > self.threshold)
+        next_below = self._next_index(ratio < self.threshold / 2)
+        first_onset = min(max(self.lta_group_size - 1 - block_start, 0), block_length)
+
+        channels, samples, kinds = [], [], []
+        positions = np.zeros(self.n_channels, dtype=np.int64)
+        active = np.arange(self.n_channels)
+        while len(active):
+            triggered = self._triggered[active]
+            onsets = next_above[active, np.maximum(positions[active], first_onset)]
+            # the offset is the first low ratio when it is before the deadline, otherwise the deadline
+            offsets = np.minimum(next_below[active, positions[active]],
+                                 self._onset_sample[active] + self.max_gap - block_start)
+            events = np.where(triggered, offsets, onsets)
+            found = events < block_length
+            active, events, triggered = active[found], events[found], triggered[found]
+
+            channels.append(active)
+            samples.append(block_start + events)
+            kinds.append(triggered.astype(np.int8))
+            self._triggered[active] = ~triggered
+            self._onset_sample[active] = np.where(triggered, self._onset_sample[active], block_start + events)
+            positions[active] = events + 1
+
+        channels, samples, kinds = np.concatenate(channels), np.concatenate(samples), np.concatenate(kinds)
+        order = np.lexsort((channels, samples))  # stable, so the events of one channel at one sample keep their order
+        return channels[order], samples[order], kinds[order]
+
+    def process(self, block, return_ratio=False):
+        """
+        Process the next block of samples of all the channels.
+        :param block: array (n_channels, n_samples), a 1-D array is taken as one sample of every channel.
+        :return: list of TriggerEvent (sample is the index from the stream start), and the block STA/LTA if asked.
+        """
+        block = np.asarray(block, dtype=float)
+        if block.ndim == 1:
+            block = block[:, None]
+        assert block.shape[0] == self.n_channels, "The block must have a row for each channel"
+
+        ratio = self._calculate_sta_lta(block)
+        channels, samples, kinds = self._find_events(ratio)
+        self.samples_count += block.shape[1]
+        events = [TriggerEvent(int(channel), int(sample), 'offset' if kind else 'onset')
+                  for channel, sample, kind in zip(channels, samples, kinds)]
+
+        if return_ratio:
+            return events, ratio
+        return events
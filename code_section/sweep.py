@@ -0,0 +1,106 @@
+import numpy as np
+from itertools import product
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+from code_section.consts import SENSOR_NUMBER_SIZE, SNR_RATIO_DB, NOISE_TYPES
+from code_section.noise import add_noise
+from code_section.workspace import Workspace
+from code_section.utils.utils import load_mat_file
+from code_section.algorithms import compute_base_products, pick_gather, update_running_stats, merge_running_stats
+
+# Worker process state, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(shm_name, shape, dtype, first_break_frame, end_break_frame,
+                 sensors_sample_rate, true_first_break_samples):
+    """
+    Attach the worker to the shared memory with the clean normalized data, so the data is not pickled per task.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state.update(shm=shm,
+                         normalized_data=np.ndarray(shape, dtype=dtype, buffer=shm.buf),
+                         first_break_frame=first_break_frame,
+                         end_break_frame=end_break_frame,
+                         sensors_sample_rate=sensors_sample_rate,
+                         true_first_break_samples=true_first_break_samples,
+                         workspace=Workspace())
+
+
+def _run_shard(shard):
+    """
+    Run the Monte Carlo iterations of one shard with its own generator.
+
+    Returns:
+        The running stats (count, mean, m2) of the shard picking errors.
+    """
+    noise_type, snr, iterations, seed_sequence = shard
+    rng = np.random.default_rng(seed_sequence)
+    normalized_data = _worker_state['normalized_data']
+    # the worker noise buffer is reused by all its shards
+    noised_batch = add_noise(normalized_data, snr_db=snr, noise_type=noise_type,
+                             fs=_worker_state['sensors_sample_rate'], rng=rng, trials=iterations,
+                             out=_worker_state['workspace'].get('noised_batch', (iterations,) + normalized_data.shape))
+    errors = pick_gather(noised_batch, _worker_state['first_break_frame'], _worker_state['end_break_frame'],
+                         _worker_state['sensors_sample_rate']) - _worker_state['true_first_break_samples']
+    return update_running_stats(0, 0.0, 0.0, errors)
+
+
+def run_parallel_performance_analysis(data_file_path: str, num_iterations: int, max_workers=None, seed=0,
+                                      shard_size=25, pattern_method="sta_lta", cache=None):
+    """
+    Parallel and reproducible variation of run_performance_analysis.
+    The (noise_type, snr, iterations) cells are split to shards of up to shard_size iterations and run on a
+    process pool. Each shard gets its own generator spawned from np.random.SeedSequence(seed), and the shards
+    are merged in a fixed order, so the results are bit-identical for any max_workers.
+    cache is an optional ResultCache for the clean data products (see compute_base_products).
+
+    Returns:
+        The same results structure as run_performance_analysis.
+    """
+    sensors_data_dict = load_mat_file(mat_path_file=data_file_path)
+    sensors_sample_rate = sensors_data_dict['fs'][0][0]
+    sensors_data = np.asarray(sensors_data_dict['data'])[:SENSOR_NUMBER_SIZE]
+
+    base_products = compute_base_products(sensors_data, sensors_sample_rate, pattern_method, cache=cache)
+    normalized_data = base_products['normalized_data']
+    first_break_frame, end_break_frame = (int(frame) for frame in base_products['pattern_range'])
+    true_first_break_samples = base_products['reference_first_breaks']
+
+    cells = list(product(NOISE_TYPES, SNR_RATIO_DB))
+    shard_iterations = [min(shard_size, num_iterations - start) for start in range(0, num_iterations, shard_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(cells) * len(shard_iterations))
+    shards = [(noise_type, snr, iterations, seed_sequences[cell_num * len(shard_iterations) + shard_num])
+              for cell_num, (noise_type, snr) in enumerate(cells)
+              for shard_num, iterations in enumerate(shard_iterations)]
+
+    shm = shared_memory.SharedMemory(create=True, size=normalized_data.nbytes)
+    try:
+        np.ndarray(normalized_data.shape, dtype=normalized_data.dtype, buffer=shm.buf)[:] = normalized_data
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(shm.name, normalized_data.shape, normalized_data.dtype,
+                                           first_break_frame, end_break_frame, sensors_sample_rate,
+                                           true_first_break_samples)) as executor:
+            shards_stats = list(executor.map(_run_shard, shards))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    results = [{} for _ in range(SENSOR_NUMBER_SIZE)]
+    mean_errors = {noise_type: [] for noise_type in NOISE_TYPES}
+    std_errors = {noise_type: [] for noise_type in NOISE_TYPES}
+    for cell_num, (noise_type, snr) in enumerate(cells):
+        count, mean_error, m2_error = 0, np.zeros(SENSOR_NUMBER_SIZE), np.zeros(SENSOR_NUMBER_SIZE)
+        for shard_stats in shards_stats[cell_num * len(shard_iterations):(cell_num + 1) * len(shard_iterations)]:
+            count, mean_error, m2_error = merge_running_stats(count, mean_error, m2_error, *shard_stats)
+
+        mean_errors[noise_type].append(mean_error)
+        std_errors[noise_type].append(np.sqrt(m2_error / count))
+
+    for noise_type in NOISE_TYPES:
+        noise_mean_errors, noise_std_errors = np.array(mean_errors[noise_type]), np.array(std_errors[noise_type])
+        for i in range(SENSOR_NUMBER_SIZE):
+            results[i][noise_type] = {'mean': noise_mean_errors[:, i], 'std': noise_std_errors[:, i]}
+
+    return results
@@ -1,3 +0,0 @@
-import numpy as np
-import scipy.io as sio
-import matplotlib.pyplot as plt
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+
+from code_section.utils.utils import load_mat_file
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+MAT_V73_HEADER_SIZE = 512
+
+
+class DataSource:
+    """
+    Lazy access to a gather of traces with its sampling rate and geometry.
+    data is an (n_traces, n_samples) array-like, for memory-mapped files the slices of it are zero-copy views,
+    so the pickers can iterate over trace blocks or time windows with a flat memory no matter the file size.
+    """
+    def __init__(self, data, fs, geometry=None):
+        self.data = data
+        self.fs = fs
+        self.geometry = np.zeros((data.shape[0], 3)) if geometry is None else np.asarray(geometry)
+
+    @property
+    def n_traces(self):
+        return self.data.shape[0]
+
+    @property
+    def n_samples(self):
+        return self.data.shape[1]
+
+    def read(self, traces=slice(None), samples=slice(None)) -> np.ndarray:
+        """
+        Read the traces[samples] part of the gather (a view when the data is memory-mapped).
+        """
+        return np.asarray(self.data[traces, samples])
+
+    def iter_trace_blocks(self, block_size=256):
+        """
+        Yield (first trace index, block (traces, n_samples)) for consecutive blocks of block_size traces.
+        """
+        for start in range(0, self.n_traces, block_size):
+            yield start, self.read(traces=slice(start, start + block_size))
+
+    def iter_time_windows(self, window_size, step=None, traces=slice(None)):
+        """
+        Yield (first sample index, window (traces, window_size)) for windows of window_size samples every step samples.
+        """
+        step = step or window_size
+        for start in range(0, self.n_samples, step):
+            yield start, self.read(traces=traces, samples=slice(start, start + window_size))
+            if start + window_size >= self.n_samples:
+                break
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MatSource(DataSource):
+    """
+    MATLAB v5 .mat file, scipy.io.loadmat can't read these lazily so the data is loaded to the memory.
+    """
+    def __init__(self, mat_path_file):
+        sensors_data_dict = load_mat_file(mat_path_file=mat_path_file)
+        super().__init__(data=sensors_data_dict['data'], fs=sensors_data_dict['fs'][0][0],
+                         geometry=sensors_data_dict.get('geometry'))
+
+
+class _MatlabH5Array:
+    """
+    (n_traces, n_samples) view of a chunked MATLAB v7.3 dataset, MATLAB saves the arrays transposed.
+    Only the indexed part is read from the file.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape[::-1]
+        self.dtype = dataset.dtype
+
+    def __getitem__(self, key):
+        traces, samples = key if isinstance(key, tuple) else (key, slice(None))
+        return self.dataset[samples, traces].T
+
+
+class MatV73Source(DataSource):
+    """
+    MATLAB v7.3 (HDF5) .mat file, requires h5py.
+    A contiguous uncompressed 'data' dataset is memory-mapped, a chunked one is read by the indexed parts.
+    """
+    def __init__(self, mat_path_file):
+        try:
+            import h5py
+        except ImportError as error:
+            raise ImportError("h5py is required for reading MATLAB v7.3 files") from error
+
+        self._file = h5py.File(mat_path_file, "r")
+        dataset = self._file['data']
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and dataset.compression is None and offset is not None:
+            data = np.memmap(mat_path_file, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape).T
+        else:
+            data = _MatlabH5Array(dataset)
+
+        geometry = self._file['geometry'][()].T if 'geometry' in self._file else None
+        super().__init__(data=data, fs=self._file['fs'][()].flat[0], geometry=geometry)
+
+    def close(self):
+        self._file.close()
+
+
+class RawBinarySource(DataSource):
+    """
+    Raw binary gather (SEG-Y-like): an optional file header and then the traces one after the other,
+    each with an optional trace header. The traces are memory-mapped and never copied.
+    For IEEE float SEG-Y: file_header_bytes=3600, trace_header_bytes=240, dtype='>f4'.
+    """
+    def __init__(self, file_path, n_samples, fs, dtype="<f4", file_header_bytes=0, trace_header_bytes=0,
+                 geometry=None):
+        trace_dtype = np.dtype([('header', f"V{trace_header_bytes}"), ('data', dtype, (n_samples,))]) \
+            if trace_header_bytes else np.dtype((dtype, (n_samples,)))
+        n_traces = (os.path.getsize(file_path) - file_header_bytes) // trace_dtype.itemsize
+        traces = np.memmap(file_path, dtype=trace_dtype, mode="r", offset=file_header_bytes, shape=(n_traces,))
+        data = traces['data'] if trace_header_bytes else traces
+        super().__init__(data=data, fs=fs, geometry=geometry)
+
+
+def is_mat_v73(mat_path_file) -> bool:
+    with open(mat_path_file, "rb") as mat_file:
+        mat_file.seek(MAT_V73_HEADER_SIZE)
+        return mat_file.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE
+
+
+def open_data_source(file_path, **raw_binary_params) -> DataSource:
+    """
+    Open the data file with the fitting data source:
+        * .mat v7.3 (HDF5) - MatV73Source (lazy).
+        * .mat v5 - MatSource (loaded to the memory).
+        * other files - RawBinarySource with the raw_binary_params (n_samples, fs, dtype, ...).
+    """
+    if str(file_path).lower().endswith(".mat"):
+        return MatV73Source(file_path) if is_mat_v73(file_path) else MatSource(file_path)
+    return RawBinarySource(file_path, **raw_binary_params)
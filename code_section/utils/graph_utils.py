@@ -1,40 +1,49 @@
 import numpy as np
-import matplotlib.pyplot as plt
+# matplotlib is imported by the plotting functions on first use, so importing this module stays cheap
+
+from code_section.instrumentation import get_instrumentation
+
+instrumentation = get_instrumentation()
 
 def plot_seismogram(sensors_list, plot_title="Title"):
     """
     Function for plotting seismogram.
     """
+    import matplotlib.pyplot as plt
+
     assert len(sensors_list) > 0, "sensors_list is empty"
     dt = 1.0 / sensors_list[0].sampling_rate
     time = np.arange(len(sensors_list[0].data)) * dt
 
     full_data = [sensor_i.data for sensor_i in sensors_list]
 
-    plt.figure(figsize=(14, 6))
-    scale = 0.5 / np.max(np.abs(full_data))
-    offset = np.arange(len(sensors_list)) * 1.0
-
-    for i in range(len(sensors_list)):
-        trace = sensors_list[i].data
-        plt.plot(offset[i] + trace * scale, time, 'k')
-        # first-break(s)
-        if isinstance(sensors_list[i].first_break_time, float):
-            plt.plot(offset[i], sensors_list[i].first_break_time, 'ro')
-        else:
-            for first_break in sensors_list[i].first_break_time:
-                plt.plot(offset[i], first_break, 'ro')
-
-    plt.gca().invert_yaxis()
-    plt.xlabel("Trace Number")
-    plt.ylabel("T (s)")
-    plt.title(plot_title)
+    with instrumentation.stage('plotting', traces=len(sensors_list)):
+        plt.figure(figsize=(14, 6))
+        scale = 0.5 / np.max(np.abs(full_data))
+        offset = np.arange(len(sensors_list)) * 1.0
+
+        for i in range(len(sensors_list)):
+            trace = sensors_list[i].data
+            plt.plot(offset[i] + trace * scale, time, 'k')
+            # first-break(s)
+            if isinstance(sensors_list[i].first_break_time, float):
+                plt.plot(offset[i], sensors_list[i].first_break_time, 'ro')
+            else:
+                for first_break in sensors_list[i].first_break_time:
+                    plt.plot(offset[i], first_break, 'ro')
+
+        plt.gca().invert_yaxis()
+        plt.xlabel("Trace Number")
+        plt.ylabel("T (s)")
+        plt.title(plot_title)
     plt.show()
 
 def plot_traces_subplots(full_data, fs, n_show=None):
     """
     Function for plotting traces of all the sensors samples according to [Time * Amplitude]
     """
+    import matplotlib.pyplot as plt
+
     n_traces, n_samples = full_data.shape
     dt = 1.0 / fs
     time = np.arange(n_samples) * dt
@@ -60,6 +69,8 @@ def plot_frequency_analysis_multichannel(sensors_list, nperseg=256, noverlap=128
     """
     Plot magnitude spectrum and spectrogram for multiple sensors.
     """
+    import matplotlib.pyplot as plt
+
     if not sensors_list:
         raise AttributeError("sensors_list is empty")
 
@@ -97,6 +108,8 @@ def plot_performance_results(results, snr_range, sampling_rate, sensor_index=0):
     """
     Plots mean error and std deviation vs SNR for one sensor.
     """
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(10, 6))
     sensor_results = results[sensor_index]
 
@@ -119,3 +132,93 @@ def plot_performance_results(results, snr_range, sampling_rate, sensor_index=0):
     ax.legend()
     ax.grid(True, linestyle="--", alpha=0.6)
     plt.show()
+
+def min_max_decimate(full_data, n_bins):
+    """
+    Decimate every trace (last axis) to n_bins bins, keeping the minimum and the maximum of each bin
+    so the peaks are still drawn at the pixel resolution.
+
+    Returns:
+        bins_start - first sample of each bin.
+        minimum, maximum - (n_traces, n_bins) of each bin.
+    """
+    n_traces, n_samples = full_data.shape
+    bin_size = max(1, int(np.ceil(n_samples / n_bins)))
+    n_bins = int(np.ceil(n_samples / bin_size))
+    padded = np.pad(full_data, ((0, 0), (0, n_bins * bin_size - n_samples)), mode='edge')
+    binned = padded.reshape(n_traces, n_bins, bin_size)
+    return np.arange(n_bins) * bin_size, binned.min(axis=-1), binned.max(axis=-1)
+
+def _picks_points(first_break_times, n_traces):
+    """
+    (trace, time) of all the picks from a pick per trace array, a list with a float or a list per trace,
+    or a Gather picks structured array.
+    """
+    if first_break_times is None:
+        return np.empty(0), np.empty(0)
+    if isinstance(first_break_times, np.ndarray) and first_break_times.dtype.names:
+        return first_break_times['trace'], first_break_times['time']
+    traces, times = [], []
+    for trace_num in range(n_traces):
+        trace_picks = np.atleast_1d(np.asarray(first_break_times[trace_num], dtype=float))
+        traces.extend([trace_num] * len(trace_picks))
+        times.extend(trace_picks)
+    return np.asarray(traces), np.asarray(times)
+
+def render_seismogram(full_data, sampling_rate, first_break_times=None, output_path="seismogram.png",
+                      plot_title="Title", mode="wiggle", width_px=1400, height_px=600, dpi=100):
+    """
+    Headless seismogram rendering straight to a PNG/SVG file (Agg canvas, no pyplot and no plt.show).
+    The gather is drawn at the pixel resolution: mode 'wiggle' is one LineCollection of the min/max decimated
+    traces and mode 'density' is one variable-density image. The picks are one scatter.
+    :param full_data: (n_traces, n_samples) array, a Gather or a list of SensorObj.
+    :param first_break_times: pick per trace array, list of float / list per trace or Gather picks.
+                              By default the picks of the Gather / SensorObj list.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.collections import LineCollection
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    if not isinstance(full_data, np.ndarray):
+        sensors_list = full_data
+        if first_break_times is None:
+            first_break_times = sensors_list.picks if hasattr(sensors_list, 'picks') else \
+                [sensor_i.first_break_time for sensor_i in sensors_list]
+        full_data = sensors_list.data if hasattr(sensors_list, 'picks') else \
+            np.array([sensor_i.data for sensor_i in sensors_list])
+    n_traces, n_samples = full_data.shape
+    assert n_traces > 0, "full_data is empty"
+
+    with instrumentation.stage('plotting', traces=n_traces):
+        fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        bins_start, minimum, maximum = min_max_decimate(full_data, n_bins=height_px)
+        bins_time = bins_start / sampling_rate
+
+        if mode == "wiggle":
+            scale = 0.5 / max(np.max(np.abs(minimum)), np.max(np.abs(maximum)), 1e-12)
+            offset = np.arange(n_traces)[:, None]
+            # every bin is a vertical segment from its minimum to its maximum, joined to the next bin
+            amplitudes = np.stack([minimum, maximum], axis=-1).reshape(n_traces, -1) * scale + offset
+            times = np.repeat(bins_time, 2)
+            segments = np.stack([amplitudes, np.broadcast_to(times, amplitudes.shape)], axis=-1)
+            ax.add_collection(LineCollection(segments, colors='k', linewidths=0.5))
+            ax.set_xlim(-1, n_traces)
+        elif mode == "density":
+            # the bin value is its larger absolute extreme, the color scale is symmetric
+            values = np.where(np.abs(maximum) >= np.abs(minimum), maximum, minimum)
+            limit = max(np.max(np.abs(values)), 1e-12)
+            ax.imshow(values.T, aspect='auto', cmap='seismic', vmin=-limit, vmax=limit, interpolation='nearest',
+                      extent=(-0.5, n_traces - 0.5, n_samples / sampling_rate, 0))
+        else:
+            raise ValueError("mode must be 'wiggle' or 'density'")
+
+        pick_traces, pick_times = _picks_points(first_break_times, n_traces)
+        ax.scatter(pick_traces, pick_times, c='r', s=12, zorder=3)
+        ax.set_ylim(n_samples / sampling_rate, 0)
+        ax.set_xlabel("Trace Number")
+        ax.set_ylabel("T (s)")
+        ax.set_title(plot_title)
+        fig.savefig(output_path)
+    return output_path
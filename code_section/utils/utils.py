@@ -1,7 +1,8 @@
 import numpy as np
-import scipy.io as sio
 
 from code_section.sensors import SensorObj
+# add_noise moved to code_section.noise, it is still importable from here
+from code_section.noise import add_noise
 
 def aic_pick(x):
     """Return index(frame) of AIC minimum (classic variance-based AIC)."""
@@ -21,38 +22,154 @@ def aic_pick(x):
     idx = np.argmin(aic) + 1
     return idx
 
+def aic_pick_batch(traces, windows=None, return_curve=False, top_k=None, workspace=None):
+    """
+    Vectorized aic_pick for a 2-D array of traces, each one searched in its own window.
+    :param traces: array (n_traces, n_samples).
+    :param windows: array (n_traces, 2) of [start, end) sample ranges, the full trace by default.
+    :param return_curve: return also the AIC curves (n_traces, max window length - 2), AIC[j] is the split at
+                         window index j + 1 and it is inf outside the trace window.
+    :param top_k: return also the (n_traces, top_k) indices of the top_k smallest local minima of each AIC,
+                  sorted by the AIC value and padded with -1.
+    :param workspace: optional Workspace (code_section.workspace) for the window and AIC buffers, the returned
+                      curves are then a workspace buffer (valid until its next use).
+    :return: the AIC minimum index (frame) of each trace from the start of the trace,
+             followed by the asked curves / minima.
+    """
+    traces = np.asarray(traces, dtype=float)
+    n_traces, n_samples = traces.shape
+    if windows is None:
+        windows = np.tile([0, n_samples], (n_traces, 1))
+    windows = np.asarray(windows, dtype=np.int64)
+    start, end = windows[:, 0], windows[:, 1]
+    N = end - start
+    assert np.all(N >= 3) and np.all(start >= 0) and np.all(end <= n_samples), "Invalid AIC windows"
+
+    def buffer(name, shape, dtype=np.float64):
+        return np.empty(shape, dtype) if workspace is None else workspace.get(name, shape, dtype)
+
+    # Gather the windows to one (n_traces, max window length) array, the samples after the window end are zeros
+    shape = (n_traces, N.max())
+    positions = np.arange(shape[1])
+    in_window = positions < N[:, None]
+    index = buffer('aic_index', shape, np.int64)
+    np.add(start[:, None], positions, out=index)
+    np.minimum(index, n_samples - 1, out=index)
+    index += (np.arange(n_traces) * n_samples)[:, None]
+    x = np.take(traces, index, out=buffer('aic_windows', shape))
+    x *= in_window
+
+    # the demeaned windows, their squares and cumulative sum are computed in place
+    x -= (np.sum(x, axis=1) / N)[:, None]
+    x *= in_window
+    np.square(x, out=x)
+    cumsq = np.cumsum(x, axis=1, out=x)
+    total = cumsq[np.arange(n_traces), N - 1][:, None]
+    eps = 1e-20
+
+    k = positions[1:-1]
+    cumsq = cumsq[:, :-2]
+    aic, var2 = buffer('aic_curve', cumsq.shape), buffer('aic_var2', cumsq.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.divide(cumsq, k, out=aic)
+        np.maximum(aic, eps, out=aic)
+        np.log(aic, out=aic)
+        aic *= k
+        np.subtract(total, cumsq, out=var2)
+        var2 /= N[:, None] - k
+        np.maximum(var2, eps, out=var2)
+        np.log(var2, out=var2)
+        var2 *= N[:, None] - k - 1
+        aic += var2
+    aic[k >= N[:, None] - 1] = np.inf
+
+    picks = start + np.argmin(aic, axis=1) + 1
+    if not return_curve and top_k is None:
+        return picks
+
+    outputs = [picks]
+    if return_curve:
+        outputs.append(aic)
+    if top_k is not None:
+        padded = np.pad(aic, ((0, 0), (1, 1)), constant_values=np.inf)
+        is_minimum = (aic < padded[:, :-2]) & (aic <= padded[:, 2:]) & np.isfinite(aic)
+        minima_values = np.where(is_minimum, aic, np.inf)
+        order = np.argsort(minima_values, axis=1, kind='stable')[:, :top_k]
+        found = np.isfinite(np.take_along_axis(minima_values, order, axis=1))
+        outputs.append(np.where(found, start[:, None] + order + 1, -1))
+    return tuple(outputs)
+
 def load_mat_file(mat_path_file) -> dict:
+    import scipy.io as sio  # imported on first use, the compute core does not need it
     return sio.loadmat(mat_path_file)
 
-def add_noise(full_data, snr_db=2, noise_type="white", fs=2000) -> np.ndarray:
+def normalize_gather(full_data, dtype=None, out=None) -> np.ndarray:
+    """
+    Normalize every trace (last axis) of the gather to zero mean and unit std,
+    the same way SensorObj does for a single trace.
+    :param dtype: dtype of the result (np.float32 halves the memory), by default float64 (or the out dtype).
+    :param out: preallocated array to write the result to, out=full_data normalizes in place.
+    """
+    full_data = np.asarray(full_data)
+    if out is None and dtype is None:
+        return (full_data - np.mean(full_data, axis=-1, keepdims=True)) / np.std(full_data, axis=-1, keepdims=True)
+
+    # the same operations as above, so the result is identical when the data and out dtypes are the same
+    mean, std = np.mean(full_data, axis=-1, keepdims=True), np.std(full_data, axis=-1, keepdims=True)
+    if out is None:
+        out = np.empty(full_data.shape, dtype=dtype)
+    np.subtract(full_data, mean, out=out, casting='same_kind')
+    np.divide(out, std, out=out, casting='same_kind')
+    return out
+
+def sta_lta_gather(normalized_data, sta_group_size=30, lta_group_size=90, out=None, workspace=None) -> np.ndarray:
+    """
+    STA/LTA of every trace (last axis) of the gather, the same as SensorObj._calculate_sta_lta
+    (centered moving averages with zero padding) with one cumulative sum for all the traces.
+    :param out: preallocated array for the ratio (float32 or float64), the cumulative sum is always float64.
+    :param workspace: optional Workspace (code_section.workspace) for the cumulative sum and moving averages.
+    """
+    normalized_data = np.asarray(normalized_data)
+    n_samples = normalized_data.shape[-1]
+    shape = normalized_data.shape[:-1] + (n_samples,)
+
+    def buffer(name, buffer_shape):
+        return np.empty(buffer_shape) if workspace is None else workspace.get(name, buffer_shape)
+
+    cumsum = buffer('sta_lta_cumsum', normalized_data.shape[:-1] + (n_samples + 1,))
+    cumsum[..., 0] = 0
+    np.abs(normalized_data, out=cumsum[..., 1:])
+    np.cumsum(cumsum[..., 1:], axis=-1, out=cumsum[..., 1:])
+
+    def centered_mean(group_size, name):
+        # np.convolve(mode='same') index n is the sum of samples [n + (L-1)//2 - L + 1, n + (L-1)//2]
+        end = np.arange(n_samples) + (group_size - 1) // 2 + 1
+        start = end - group_size
+        mean = np.take(cumsum, np.clip(end, 0, n_samples), axis=-1, out=buffer(name, shape))
+        mean -= np.take(cumsum, np.clip(start, 0, n_samples), axis=-1)
+        mean /= group_size
+        return mean
+
+    sta = centered_mean(sta_group_size, 'sta_lta_sta')
+    lta = centered_mean(lta_group_size, 'sta_lta_lta')
+    lta += 1e-12
+    return np.divide(sta, lta, out=out)
+
+def find_break_ranges(ratio, threshold=1.75, max_gap=200) -> tuple:
     """
-    Add noise (white or pink) to a signal according to a given SNR.
+    The SensorObj.find_break_range onset / offset rules for every trace (last axis) of the STA/LTA ratio:
+        * first_break_frame - the first index where ratio > threshold.
+        * end_break_frame - the first index after it where ratio < threshold/2, forced to
+          min(first_break_frame + max_gap, length - 1) when not found or too far.
     """
-    data_plus_noise = []
-    for d in full_data:
-        data = np.array(d)
-        sig_power = np.mean(data ** 2)
-        snr_linear = 10 ** (snr_db / 10)
-        noise_power = sig_power / snr_linear
-
-        if noise_type.lower() == "white":
-            noise = np.random.normal(0, np.sqrt(noise_power), len(data))
-
-        elif noise_type.lower() == "pink":
-            # Pink noise via frequency-domain shaping
-            white = np.random.normal(0, 1, len(data))
-            fft_vals = np.fft.rfft(white)
-            freqs = np.fft.rfftfreq(len(data), 1 / fs)
-            fft_vals /= np.where(freqs == 0, 1, np.sqrt(freqs))
-            pink = np.fft.irfft(fft_vals, n=len(data))
-            pink = pink / np.std(pink) * np.sqrt(noise_power)
-            noise = pink
-
-        else:
-            raise ValueError("noise_type must be 'white' or 'pink'")
-
-        data_plus_noise.append(data + noise)
-    return np.array(data_plus_noise)
+    n_samples = ratio.shape[-1]
+    first_break_frames = np.argmax(ratio > threshold, axis=-1)
+    positions = np.arange(n_samples)
+    below = (ratio < threshold / 2) & (positions > first_break_frames[..., None])
+    end_break_frames = np.argmax(below, axis=-1)
+    forced = ~np.any(below, axis=-1) | (end_break_frames - first_break_frames > max_gap)
+    end_break_frames = np.where(forced, np.minimum(first_break_frames + max_gap, n_samples - 1), end_break_frames)
+    return first_break_frames, end_break_frames
 
 def separate_channels(sensor: SensorObj, threshold_magnitude = 0.052):
     """
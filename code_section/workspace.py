@@ -0,0 +1,29 @@
+import numpy as np
+
+
+class Workspace:
+    """
+    Named scratch buffers that are reused across calls, for the out= arguments of the picking stages.
+    A buffer is allocated again only when a call needs more memory than it has (a smaller last block of traces
+    reuses the buffer of the full blocks), so a loop over blocks or Monte Carlo batches allocates once.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.float64) -> np.ndarray:
+        """
+        An uninitialized C-contiguous array of the shape and dtype backed by the named buffer.
+        """
+        shape, dtype = tuple(int(size) for size in np.atleast_1d(shape)), np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.nbytes < nbytes:
+            buffer = self._buffers[name] = np.empty(nbytes, dtype=np.uint8)
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        self._buffers.clear()
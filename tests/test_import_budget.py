@@ -0,0 +1,19 @@
+import pytest
+
+from benchmarks.run_benchmarks import CORE_MODULES, measure_import
+
+IMPORT_BUDGET_S = 0.6  # the README budget of python -m benchmarks.run_benchmarks --import-budget
+REPEATS = 3
+
+
+@pytest.mark.parametrize("module_name", CORE_MODULES)
+def test_core_module_import(module_name):
+    # every import is in a fresh interpreter, a slow first one (cold file cache) is measured again
+    import_times = []
+    for _ in range(REPEATS):
+        import_time, heavy_modules = measure_import(module_name)
+        assert not heavy_modules, f"{module_name} imports {heavy_modules}"
+        import_times.append(import_time)
+        if import_time < IMPORT_BUDGET_S:
+            break
+    assert min(import_times) < IMPORT_BUDGET_S, f"{module_name} imports in {min(import_times):.3f} s"
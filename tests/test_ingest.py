@@ -0,0 +1,82 @@
+import asyncio
+
+import numpy as np
+
+from code_section.ingest import IngestServer, ChannelRingBuffer, HELLO, MSG_HELLO, MSG_SAMPLES, MSG_END, SAMPLES, \
+    encode_frame, encode_samples
+
+N_CHANNELS, PACKET_SIZE, WINDOW_SIZE = 4, 100, 1000
+
+
+def recording_picker(picked_windows):
+    def picker(window, sampling_rate):
+        picked_windows.append(window.copy())
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return picker
+
+
+async def replay(server, packets):
+    """
+    Send HELLO, the raw frames of packets and END as one source, and wait until its windows are picked.
+    """
+    reader, writer = await asyncio.open_connection(*server.address[:2])
+    writer.write(encode_frame(MSG_HELLO, HELLO.pack(N_CHANNELS, 2000.0)))
+    for frame in packets:
+        writer.write(frame)
+    writer.write(encode_frame(MSG_END))
+    await writer.drain()
+    await reader.read()  # the server closes the connection at the end of the source
+    writer.close()
+    await server.drain()
+
+
+def run_server(packets_list):
+    """
+    Replay every packets list as one source and return the server stats, the picked windows and the
+    exceptions asyncio did not handle.
+    """
+    async def main():
+        unhandled = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        picked_windows = []
+        server = await IngestServer(window_size=WINDOW_SIZE, picker=recording_picker(picked_windows)).start()
+        try:
+            for packets in packets_list:
+                await replay(server, packets)
+        finally:
+            await server.close()
+        return server.stats, picked_windows, unhandled
+    return asyncio.run(main())
+
+
+def sample_packets(first_sample, last_sample):
+    return [encode_samples(start, np.full((N_CHANNELS, PACKET_SIZE), start, dtype=np.float32))
+            for start in range(first_sample, last_sample, PACKET_SIZE)]
+
+
+def test_ring_buffer_reset():
+    ring = ChannelRingBuffer(n_channels=1, capacity=10)
+    ring.write(np.arange(8, dtype=np.float32)[None])
+    ring.reset(100)
+    ring.write(np.arange(3, dtype=np.float32)[None])
+    assert (ring.start, ring.end) == (100, 103)
+    np.testing.assert_array_equal(ring.read(100, 3), [[0, 1, 2]])
+
+
+def test_large_gaps_restart_the_windows():
+    # gaps of 2050 samples (fits in the 2100 samples ring buffer) and 3000 samples (longer than it)
+    packets = sample_packets(0, 1100) + sample_packets(3150, 4050) + sample_packets(7050, 9050)
+    stats, picked_windows, unhandled = run_server([packets])
+    assert not unhandled
+    assert stats['gap_samples'] == 2050 + 3000
+    assert stats['skipped_windows'] > 0
+    assert stats['windows'] == len(picked_windows) > 0
+    # the windows after the restart hold the samples of the packets (the packet start), not zeros
+    np.testing.assert_array_equal(picked_windows[-1][0, ::PACKET_SIZE], np.arange(8050, 9050, PACKET_SIZE))
+
+
+def test_malformed_payload_closes_only_its_connection():
+    truncated = encode_frame(MSG_SAMPLES, SAMPLES.pack(1100, PACKET_SIZE) + b'\x00' * 7)
+    stats, picked_windows, unhandled = run_server([sample_packets(0, 1100) + [truncated], sample_packets(0, 1000)])
+    assert not unhandled
+    assert stats['windows'] == 2  # one window of each source, the server still serves after the bad payload
@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.signal import correlate
+
+from benchmarks.run_benchmarks import synthetic_gather
+from code_section.correlation import PilotCorrelator
+from code_section.utils.utils import aic_pick, aic_pick_batch, normalize_gather
+
+
+def test_aic_pick_batch_equals_aic_pick():
+    data, _, _ = synthetic_gather(n_sensors=32, n_samples=1000, seed=2)
+    traces = normalize_gather(data.astype(np.float64))
+    rng = np.random.default_rng(2)
+    starts = rng.integers(0, 500, len(traces))
+    windows = np.stack([starts, starts + rng.integers(3, 500, len(traces))], axis=-1)
+
+    expected = [start + aic_pick(trace[start:end]) for trace, (start, end) in zip(traces, windows)]
+    np.testing.assert_array_equal(aic_pick_batch(traces, windows), expected)
+    np.testing.assert_array_equal(aic_pick_batch(traces), [aic_pick(trace) for trace in traces])
+
+
+def test_pilot_correlator_equals_scipy_correlate():
+    data, _, _ = synthetic_gather(n_sensors=16, n_samples=4000, n_sources=3, seed=3)
+    traces = normalize_gather(data.astype(np.float64))
+    signal_pattern = traces[0, 100:550]
+    expected = np.array([correlate(trace, signal_pattern, mode='valid') for trace in traces])
+
+    # one FFT per trace and overlap-save on blocks shorter than the traces
+    for correlator in (PilotCorrelator(signal_pattern), PilotCorrelator(signal_pattern, block_size=1024)):
+        np.testing.assert_allclose(correlator.correlate(traces), expected, atol=1e-9 * np.abs(expected).max())
+        np.testing.assert_array_equal(correlator.pick(traces), np.argmax(expected, axis=-1))
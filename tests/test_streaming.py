@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from benchmarks.run_benchmarks import synthetic_gather
+from code_section.streaming import StreamingStaLta
+
+STA_GROUP_SIZE, LTA_GROUP_SIZE = 30, 90
+
+
+def trailing_sta_lta(data):
+    """
+    The float64 cumulative sum reference of the StreamingStaLta ratio (trailing windows, zeros before the start).
+    """
+    cumsum = np.concatenate([np.zeros((len(data), 1)), np.cumsum(np.abs(data), axis=1)], axis=1)
+    end = np.arange(1, data.shape[1] + 1)
+
+    def trailing_mean(group_size):
+        return (cumsum[:, end] - cumsum[:, np.maximum(end - group_size, 0)]) / group_size
+
+    return trailing_mean(STA_GROUP_SIZE) / (trailing_mean(LTA_GROUP_SIZE) + 1e-12)
+
+
+def stream(data, block_size, fs):
+    trigger = StreamingStaLta(len(data), fs, STA_GROUP_SIZE, LTA_GROUP_SIZE)
+    trigger.resync_samples = 1000  # a few resyncs in the stream
+    events, ratios = [], []
+    for start in range(0, data.shape[1], block_size):
+        block_events, ratio = trigger.process(data[:, start:start + block_size], return_ratio=True)
+        events.extend(block_events)
+        ratios.append(ratio)
+    return sorted(events, key=lambda event: (event.sample, event.channel)), np.concatenate(ratios, axis=1)
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1000, 4000])
+def test_streaming_sta_lta_does_not_depend_on_the_block_size(block_size):
+    data, fs, _ = synthetic_gather(n_sensors=8, n_samples=4000, n_sources=3, seed=1)
+    data = data.astype(np.float64)
+    reference_events, _ = stream(data, data.shape[1], fs)
+    events, ratio = stream(data, block_size, fs)
+    np.testing.assert_allclose(ratio, trailing_sta_lta(data), rtol=1e-9, atol=1e-9)
+    assert events == reference_events
+    assert any(event.kind == 'onset' for event in events)
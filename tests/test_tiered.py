@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import numpy as np
+
+from code_section.algorithms import tiered_picking_algorithm
+from code_section.correlation import PilotCorrelator
+from code_section.utils.utils import load_mat_file, normalize_gather
+
+RICKER_FILE = Path(__file__).parent.parent / 'data' / 'simulation_ricker.mat'
+
+
+def test_tier0_picks_agree_with_the_pilot_correlation():
+    data = load_mat_file(str(RICKER_FILE))
+    sensors_data, sampling_rate = data['data'], data['fs'][0][0]
+    first_breaks, quality = tiered_picking_algorithm(sensors_data, sampling_rate)
+    picks = np.round(first_breaks * sampling_rate).astype(int)
+    accepted = np.flatnonzero(quality['tier'] == 0)
+    assert len(accepted) > len(picks) // 2
+
+    # the pilot is the onset of the best accepted trace, the correlation of every other accepted trace with it
+    # predicts its onset (the far traces, with another wavelet shape, have a weak peak and are not compared)
+    normalized_data = normalize_gather(sensors_data)
+    pilot_trace = accepted[np.argmax(quality['score'][accepted])]
+    pattern_start = picks[pilot_trace] - 30
+    correlator = PilotCorrelator(normalized_data[pilot_trace, pattern_start:picks[pilot_trace] + 100])
+    lags, peaks, _ = correlator.pick_quality(normalized_data[accepted])
+    predicted = lags + picks[pilot_trace] - pattern_start
+    compared = peaks > 0.5
+    assert np.sum(compared) > len(accepted) * 0.9
+    np.testing.assert_array_less(np.abs(predicted - picks[accepted])[compared], 8)
+
+    # the clean data is zero before the first motion, no accepted pick is on the coda or the trace end
+    first_motion = np.argmax(np.abs(normalized_data) > 0.01 * np.max(np.abs(normalized_data), axis=-1,
+                                                                       keepdims=True), axis=-1)
+    np.testing.assert_array_less(np.abs(picks[accepted] - first_motion[accepted]), 8)